@@ -0,0 +1,157 @@
+# api_encoding.py - UTF-8 JSON provider and negotiated response compression
+import gzip
+import threading
+from collections import OrderedDict
+
+from flask import request
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+try:
+    from flask.json.provider import DefaultJSONProvider
+except ImportError:  # Flask < 2.2
+    DefaultJSONProvider = None
+
+COMPRESSIBLE_MIMETYPES = {"application/json", "text/plain", "text/html", "text/csv", "image/svg+xml"}
+
+
+if DefaultJSONProvider is not None:
+    class FastJSONProvider(DefaultJSONProvider):
+        # Thai text is emitted as UTF-8 instead of \uXXXX escapes (about a third of the
+        # bytes). orjson does the encoding when installed; datetimes are passed through
+        # to Flask's default so they keep the same RFC 822 format as before.
+        ensure_ascii = False
+
+        def _orjson_options(self, indent):
+            options = orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_NON_STR_KEYS
+            if self.sort_keys:
+                options |= orjson.OPT_SORT_KEYS
+            if indent:
+                options |= orjson.OPT_INDENT_2
+            return options
+
+        def dumps(self, obj, **kwargs):
+            if orjson is not None and set(kwargs) <= {"indent", "separators"}:
+                try:
+                    return orjson.dumps(obj, default=self.default,
+                                        option=self._orjson_options(kwargs.get("indent"))).decode("utf-8")
+                except TypeError:
+                    pass
+            return super().dumps(obj, **kwargs)
+
+        def response(self, *args, **kwargs):
+            if orjson is None:
+                return super().response(*args, **kwargs)
+            obj = self._prepare_response_obj(args, kwargs)
+            indent = (self.compact is None and self._app.debug) or self.compact is False
+            try:
+                body = orjson.dumps(obj, default=self.default, option=self._orjson_options(indent))
+            except TypeError:
+                return super().response(obj)
+            return self._app.response_class(body + b"\n", mimetype=self.mimetype)
+else:
+    FastJSONProvider = None
+
+
+def init_json(app):
+    if FastJSONProvider is not None:
+        app.json = FastJSONProvider(app)
+    else:
+        app.config["JSON_AS_ASCII"] = False
+
+
+def _accepted_encodings(header):
+    accepted = {}
+    for part in (header or "").split(","):
+        token, _, params = part.strip().partition(";")
+        if not token:
+            continue
+        q = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        accepted[token.strip().lower()] = q
+    return accepted
+
+
+def choose_encoding(accept_encoding):
+    accepted = _accepted_encodings(accept_encoding)
+    for encoding in ("br", "gzip"):
+        if encoding == "br" and brotli is None:
+            continue
+        q = accepted.get(encoding, accepted.get("*", 0.0))
+        if q > 0:
+            return encoding
+    return None
+
+
+def compress(body, encoding, level):
+    if encoding == "br":
+        return brotli.compress(body, quality=min(level, 11))
+    return gzip.compress(body, compresslevel=level)
+
+
+class ResponseCompressor:
+    # after_request hook: compresses text/JSON bodies of at least `min_size` bytes.
+    # Compressed bodies of responses with an ETag are memoized, so a cached API
+    # response is compressed once per encoding rather than once per request.
+
+    def __init__(self, app=None, min_size=1024, level=6, max_entries=128):
+        self.min_size = min_size
+        self.level = level
+        self.max_entries = max_entries
+        self._memo = OrderedDict()
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.after_request(self.after_request)
+
+    def _compressed(self, etag, body, encoding):
+        if not etag:
+            return compress(body, encoding, self.level)
+        key = (etag, encoding)
+        with self._lock:
+            cached = self._memo.get(key)
+            if cached is not None:
+                self._memo.move_to_end(key)
+                return cached
+        data = compress(body, encoding, self.level)
+        with self._lock:
+            self._memo[key] = data
+            while len(self._memo) > self.max_entries:
+                self._memo.popitem(last=False)
+        return data
+
+    def after_request(self, response):
+        if (response.status_code < 200 or response.status_code in (204, 206, 304)
+                or response.direct_passthrough or response.is_streamed
+                or "Content-Encoding" in response.headers
+                or response.mimetype not in COMPRESSIBLE_MIMETYPES):
+            return response
+        response.vary.add("Accept-Encoding")
+        encoding = choose_encoding(request.headers.get("Accept-Encoding"))
+        if encoding is None:
+            return response
+        body = response.get_data()
+        if len(body) < self.min_size:
+            return response
+        etag, _ = response.get_etag()
+        response.set_data(self._compressed(etag, body, encoding))
+        response.headers["Content-Encoding"] = encoding
+        if etag:
+            # the representation changed; a weak tag still matches If-None-Match
+            response.set_etag(etag, weak=True)
+        return response
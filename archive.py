@@ -0,0 +1,189 @@
+# archive.py - move cold Firestore records into gzip JSONL files, one per month
+#
+# Layout: <root>/<collection>/<YYYY-MM>.jsonl.gz. Each archive run appends a new
+# gzip member to the month's file (gzip readers concatenate members), then deletes
+# the archived documents. A run interrupted between the two steps leaves duplicates
+# in the archive, which read() collapses by doc_id.
+#
+# <root>/<collection>/index.jsonl maps doc_id -> month, appended with every batch,
+# so find() opens only the one partition holding a record instead of all of them.
+#
+# append() returns only once the data, the index and any newly created directory
+# entries are fsynced, since the caller deletes the source documents right after.
+import gzip
+import json
+import os
+import threading
+from datetime import date, datetime
+
+UNKNOWN_PARTITION = "unknown"
+
+
+def _json_default(value):
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    return str(value)
+
+
+def _fsync_dir(path):
+    # make a newly created entry in `path` survive a crash
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def month_of(value):
+    # 'YYYY-MM-DD...' string or a date/datetime -> 'YYYY-MM'
+    if isinstance(value, (datetime, date)):
+        return value.strftime("%Y-%m")
+    if isinstance(value, str) and len(value) >= 7 and value[4] == "-":
+        return value[:7]
+    return UNKNOWN_PARTITION
+
+
+class ArchiveStore:
+
+    def __init__(self, root):
+        self.root = root
+        self._lock = threading.Lock()
+        self._indexes = {}
+
+    def _path(self, collection, month):
+        return os.path.join(self.root, collection, f"{month}.jsonl.gz")
+
+    def _index_path(self, collection):
+        return os.path.join(self.root, collection, "index.jsonl")
+
+    def append(self, collection, month, records):
+        if not records:
+            return
+        lines = "".join(json.dumps(r, ensure_ascii=False, default=_json_default) + "\n" for r in records)
+        index_lines = "".join(json.dumps({"doc_id": r["doc_id"], "month": month}, ensure_ascii=False) + "\n"
+                              for r in records if r.get("doc_id"))
+        path = self._path(collection, month)
+        folder = os.path.dirname(path)
+        with self._lock:
+            if not os.path.isdir(folder):
+                os.makedirs(folder, exist_ok=True)
+                _fsync_dir(os.path.dirname(folder))
+            # index first: an entry without its record costs one partition read in
+            # find(), a record without its entry could never be found
+            self._load_index(collection)
+            index_path = self._index_path(collection)
+            created = not os.path.exists(index_path) or not os.path.exists(path)
+            with open(index_path, "a", encoding="utf-8") as f:
+                f.write(index_lines)
+                f.flush()
+                os.fsync(f.fileno())
+            with open(path, "ab") as raw:
+                # closing the GzipFile writes the member trailer before the fsync
+                with gzip.open(raw, "at", encoding="utf-8") as f:
+                    f.write(lines)
+                raw.flush()
+                os.fsync(raw.fileno())
+            if created:
+                _fsync_dir(folder)
+
+    def _load_index(self, collection):
+        # doc_id -> month, re-read only when the file changed (another process archived).
+        # Partitions written before the index existed are indexed once here.
+        path = self._index_path(collection)
+        try:
+            mtime = os.stat(path).st_mtime_ns
+        except FileNotFoundError:
+            mtime = None
+        cached = self._indexes.get(collection)
+        if cached is not None and cached[0] == mtime:
+            return cached[1]
+        index = {}
+        if mtime is None:
+            lines = [json.dumps({"doc_id": record["doc_id"], "month": month}, ensure_ascii=False) + "\n"
+                     for month in self.months(collection)
+                     for record in self._read_month(collection, month).values() if record.get("doc_id")]
+            if lines:
+                with open(path, "w", encoding="utf-8") as f:
+                    f.writelines(lines)
+                    f.flush()
+                    os.fsync(f.fileno())
+                _fsync_dir(os.path.dirname(path))
+                mtime = os.stat(path).st_mtime_ns
+        if mtime is not None:
+            with open(path, encoding="utf-8") as f:
+                for line in f:
+                    if line.strip():
+                        entry = json.loads(line)
+                        index[entry["doc_id"]] = entry["month"]
+        self._indexes[collection] = (mtime, index)
+        return index
+
+    def months(self, collection):
+        folder = os.path.join(self.root, collection)
+        if not os.path.isdir(folder):
+            return []
+        return sorted(name[:-len(".jsonl.gz")] for name in os.listdir(folder) if name.endswith(".jsonl.gz"))
+
+    def _read_month(self, collection, month):
+        records = {}
+        with gzip.open(self._path(collection, month), "rt", encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    record = json.loads(line)
+                    records[record.get("doc_id") or len(records)] = record
+        return records
+
+    def read(self, collection, start_month=None, end_month=None, match=None):
+        # Records from the month partitions in [start_month, end_month] (inclusive,
+        # either end open), optionally filtered by match(record)
+        for month in self.months(collection):
+            if month != UNKNOWN_PARTITION and ((start_month and month < start_month) or (end_month and month > end_month)):
+                continue
+            if month == UNKNOWN_PARTITION and (start_month or end_month):
+                continue
+            for record in self._read_month(collection, month).values():
+                if match is None or match(record):
+                    yield record
+
+    def find(self, collection, doc_id):
+        # One archived record by doc_id, or None; unknown ids never touch a partition
+        with self._lock:
+            month = self._load_index(collection).get(doc_id)
+        if month is None or not os.path.isfile(self._path(collection, month)):
+            return None
+        return self._read_month(collection, month).get(doc_id)
+
+
+def archive_query(db, store, collection, query, partition_field, keep=None, chunk=500):
+    # Stream `query`, append matching documents to the archive by month of
+    # `partition_field` and delete them from Firestore in batches. Returns the count
+    # moved; documents for which keep(data) is true stay in Firestore.
+    moved = 0
+    pending = []
+
+    def flush():
+        by_month = {}
+        for _, data in pending:
+            by_month.setdefault(month_of(data.get(partition_field)), []).append(data)
+        # append() has fsynced every record before the documents are deleted
+        for month, records in by_month.items():
+            store.append(collection, month, records)
+        batch = db.batch()
+        for ref, _ in pending:
+            batch.delete(ref)
+        batch.commit()
+
+    for doc in query.stream():
+        data = doc.to_dict() or {}
+        data["doc_id"] = data.get("doc_id") or doc.id
+        if keep is not None and keep(data):
+            continue
+        pending.append((doc.reference, data))
+        if len(pending) >= chunk:
+            flush()
+            moved += len(pending)
+            pending = []
+    if pending:
+        flush()
+        moved += len(pending)
+    return moved
@@ -0,0 +1,128 @@
+# attendance.py - daily and monthly attendance rollups built from duty log writes
+#
+# attendance_daily/<YYYY-MM-DD>: who was on duty and their check-in/out times, merged
+#   in as logs are written and completed by the end-of-day finalize.
+# attendance_monthly/<YYYY-MM>: per-person totals of finalized days, so a monthly
+#   report is one document read.
+from firebase_admin import firestore
+
+ON_DUTY_STATUS = "ปฏิบัติงาน"
+COUNTERS = ("on_duty_days", "checkins", "missed_checkins", "checkouts", "missed_checkouts", "late_checkouts")
+
+
+def _clock(value):
+    # "17:00" -> "17:00:00" so times compare as strings
+    return value if len(value) > 5 else f"{value}:00"
+
+
+def day_counts(people, checkout_deadline):
+    # {name: {"on_duty": bool, "checkin": "HH:MM:SS", "checkout": ...}} -> per-person counters
+    deadline = _clock(checkout_deadline)
+    counts = {}
+    for name, entry in people.items():
+        on_duty = bool(entry.get("on_duty"))
+        checkin = entry.get("checkin")
+        checkout = entry.get("checkout")
+        counts[name] = {
+            "on_duty_days": int(on_duty),
+            "checkins": int(bool(checkin)),
+            "missed_checkins": int(on_duty and not checkin),
+            "checkouts": int(bool(checkout)),
+            "missed_checkouts": int(on_duty and bool(checkin) and not checkout),
+            "late_checkouts": int(bool(checkout) and _clock(checkout) > deadline),
+        }
+    return counts
+
+
+def merge_counts(totals, counts, sign):
+    for name, item in counts.items():
+        person = totals.setdefault(name, dict.fromkeys(COUNTERS, 0))
+        for key in COUNTERS:
+            person[key] = person.get(key, 0) + sign * item.get(key, 0)
+    return totals
+
+
+class AttendanceRollups:
+
+    def __init__(self, db, daily_collection, monthly_collection, checkout_deadline="17:00"):
+        self.db = db
+        self.daily_collection = daily_collection
+        self.monthly_collection = monthly_collection
+        self.checkout_deadline = checkout_deadline
+
+    def _daily_ref(self, date_str):
+        return self.db.collection(self.daily_collection).document(date_str)
+
+    def _monthly_ref(self, month):
+        return self.db.collection(self.monthly_collection).document(month)
+
+    def record_log(self, date_str, name, log_type, time_str, duty=None):
+        # A blind merge write, no read; log_duty_action already refuses a second
+        # check-in or check-out for the same day
+        if log_type not in ("checkin", "checkout"):
+            return
+        entry = {log_type: time_str}
+        if duty is not None:
+            entry.update({"on_duty": True, "duty": duty})
+        self._daily_ref(date_str).set({
+            "date": date_str,
+            "month": date_str[:7],
+            "people": {name: entry},
+            "updated_at": firestore.SERVER_TIMESTAMP
+        }, merge=True)
+
+    def finalize(self, date_str, assignments):
+        # End of day: fold the roster into the daily document, freeze its counters and
+        # move them into the month totals. Re-running for the same day (e.g. after a
+        # late correction) replaces that day's previous contribution.
+        month = date_str[:7]
+        daily_ref = self._daily_ref(date_str)
+        monthly_ref = self._monthly_ref(month)
+
+        @firestore.transactional
+        def run(transaction):
+            snaps = {snap.id: snap for snap in transaction.get_all([daily_ref, monthly_ref])}
+            daily = snaps[date_str].to_dict() if date_str in snaps and snaps[date_str].exists else {}
+            monthly = snaps[month].to_dict() if month in snaps and snaps[month].exists else {}
+
+            people = {name: dict(entry) for name, entry in (daily.get("people") or {}).items()}
+            for entry in people.values():
+                entry["on_duty"] = False
+            for a in assignments:
+                if a.get("status") == ON_DUTY_STATUS:
+                    entry = people.setdefault(a["name"], {})
+                    entry["on_duty"] = True
+                    entry["duty"] = a.get("duty")
+            counts = day_counts(people, self.checkout_deadline)
+
+            totals = monthly.get("people") or {}
+            if daily.get("finalized"):
+                merge_counts(totals, daily.get("counts") or {}, -1)
+            merge_counts(totals, counts, 1)
+            days = sorted(set(monthly.get("finalized_days") or []) | {date_str})
+
+            transaction.set(daily_ref, {
+                "date": date_str,
+                "month": month,
+                "people": people,
+                "counts": counts,
+                "finalized": True,
+                "updated_at": firestore.SERVER_TIMESTAMP
+            })
+            transaction.set(monthly_ref, {
+                "month": month,
+                "people": totals,
+                "finalized_days": days,
+                "updated_at": firestore.SERVER_TIMESTAMP
+            })
+            return counts
+        return run(self.db.transaction())
+
+    def month_report(self, month):
+        snap = self._monthly_ref(month).get()
+        doc = snap.to_dict() if snap.exists else {}
+        people = [dict(item, name=name) for name, item in sorted((doc.get("people") or {}).items())
+                  if any(item.get(key) for key in COUNTERS)]
+        days = doc.get("finalized_days") or []
+        return {"month": month, "finalized_days": len(days),
+                "last_finalized": days[-1] if days else None, "people": people}
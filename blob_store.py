@@ -0,0 +1,149 @@
+# blob_store.py - durable storage for generated images, served without the bot
+#
+# Both engines hand out URLs that point somewhere other than the Flask worker: a
+# static file server / CDN in front of a directory, or an S3-compatible bucket
+# (AWS S3, MinIO, R2, GCS interop) through pre-signed or public URLs. Keys are
+# content-addressed by the caller, so objects are never overwritten in place.
+import os
+import threading
+import uuid
+from collections import OrderedDict
+
+try:
+    import boto3
+    from botocore.exceptions import ClientError
+except ImportError:
+    boto3 = None
+    ClientError = Exception
+
+
+class _KnownKeys:
+    # Keys already known to exist, so repeated hits skip the existence round-trip.
+    # Safe because objects are immutable; bounded like the other in-process caches.
+
+    def __init__(self, max_keys=10000):
+        self.max_keys = max_keys
+        self._keys = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __contains__(self, key):
+        with self._lock:
+            if key in self._keys:
+                self._keys.move_to_end(key)
+                return True
+            return False
+
+    def add(self, key):
+        with self._lock:
+            self._keys[key] = True
+            self._keys.move_to_end(key)
+            while len(self._keys) > self.max_keys:
+                self._keys.popitem(last=False)
+
+
+class LocalBlobStore:
+    # Files under `root`, published by a static server or CDN at `public_base_url`
+    # (nginx, a bucket mount, or `python -m http.server` as a local stand-in)
+
+    def __init__(self, root, public_base_url):
+        if not public_base_url:
+            raise ValueError("LocalBlobStore needs a public base URL for the directory")
+        self.root = root
+        self.public_base_url = public_base_url.rstrip("/")
+        self._known = _KnownKeys()
+        os.makedirs(root, exist_ok=True)
+
+    def _path(self, key):
+        path = os.path.normpath(os.path.join(self.root, key))
+        if not path.startswith(os.path.normpath(self.root) + os.sep):
+            raise ValueError(f"invalid blob key: {key}")
+        return path
+
+    def put(self, key, data, content_type="application/octet-stream"):
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{uuid.uuid4().hex[:8]}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+        self._known.add(key)
+
+    def get(self, key):
+        try:
+            with open(self._path(key), "rb") as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def exists(self, key):
+        if key in self._known:
+            return True
+        if os.path.isfile(self._path(key)):
+            self._known.add(key)
+            return True
+        return False
+
+    def url(self, key):
+        return f"{self.public_base_url}/{key}"
+
+
+class S3BlobStore:
+    # Any S3-compatible bucket. With `public_base_url` (a CDN or public bucket) URLs
+    # are plain and cacheable; otherwise each one is a pre-signed GET valid for
+    # `url_expires` seconds.
+
+    def __init__(self, bucket, endpoint_url=None, region=None, access_key=None, secret_key=None,
+                 prefix="", public_base_url=None, url_expires=3600, cache_control="public, max-age=31536000, immutable",
+                 client=None):
+        if client is None:
+            if boto3 is None:
+                raise RuntimeError("boto3 package is not installed")
+            client = boto3.client("s3", endpoint_url=endpoint_url or None, region_name=region or None,
+                                  aws_access_key_id=access_key or None, aws_secret_access_key=secret_key or None)
+        self.bucket = bucket
+        self.prefix = prefix
+        self.public_base_url = (public_base_url or "").rstrip("/")
+        self.url_expires = url_expires
+        self.cache_control = cache_control
+        self._client = client
+        self._known = _KnownKeys()
+
+    def _key(self, key):
+        return self.prefix + key
+
+    def put(self, key, data, content_type="application/octet-stream"):
+        self._client.put_object(Bucket=self.bucket, Key=self._key(key), Body=data,
+                                ContentType=content_type, CacheControl=self.cache_control)
+        self._known.add(key)
+
+    def get(self, key):
+        try:
+            obj = self._client.get_object(Bucket=self.bucket, Key=self._key(key))
+        except ClientError as e:
+            if _is_not_found(e):
+                return None
+            raise
+        return obj["Body"].read()
+
+    def exists(self, key):
+        if key in self._known:
+            return True
+        try:
+            self._client.head_object(Bucket=self.bucket, Key=self._key(key))
+        except ClientError as e:
+            if _is_not_found(e):
+                return False
+            raise
+        self._known.add(key)
+        return True
+
+    def url(self, key):
+        if self.public_base_url:
+            return f"{self.public_base_url}/{self._key(key)}"
+        return self._client.generate_presigned_url("get_object", Params={"Bucket": self.bucket, "Key": self._key(key)},
+                                                   ExpiresIn=self.url_expires)
+
+
+def _is_not_found(error):
+    code = str(getattr(error, "response", {}).get("Error", {}).get("Code", ""))
+    return code in ("404", "NoSuchKey", "NotFound")
@@ -20,13 +20,17 @@ import json
 from datetime import datetime, timedelta
 import uuid
 import logging
+import threading
 
 import firebase_admin
 from firebase_admin import credentials, firestore
+from google.api_core.exceptions import NotFound
 
 from dotenv import load_dotenv
 load_dotenv()  # อ่านตัวแปรจาก .env
 
+from resilience import CircuitBreaker, CircuitOpenError, WriteAheadLog, CLOSED, OPEN
+
 try:
     from PIL import Image, ImageDraw, ImageFont
 except ImportError:
@@ -112,6 +116,9 @@ def index():
     return jsonify({
         "status": "ok",
         "firebase_connected": db is not None,
+        "firestore_breaker": firestore_breaker.state,
+        "wal_enabled": leaves_wal is not None,
+        "wal_pending": len(leaves_wal) if leaves_wal is not None else 0,
         "has_line_config": bool(CHANNEL_ACCESS_TOKEN and CHANNEL_SECRET)
     })
 
@@ -149,39 +156,168 @@ def get_user_id_from_event(event):
     except Exception:
         return "unknown"
 
+# --- Firestore: timeout ต่อการเรียก, circuit breaker และ write-ahead log ---
+# ทุกการเรียก Firestore มี timeout ของตัวเองและไม่ retry ภายใน ถ้าล้มเหลวติดกันหลายครั้ง
+# breaker จะเปิดและข้าม Firestore ไปเลยจนกว่าจะครบ FIRESTORE_BREAKER_RESET วินาที
+# ระหว่างนั้นการเขียนจะถูกต่อท้ายไฟล์ WAL (fsync ทุกครั้ง) แล้ว replay ตามลำดับเมื่อ Firestore กลับมา
+# LEAVES_WAL_PATH ต้องอยู่บน disk ที่คงทน (ไม่ใช่ /tmp ของ instance ที่ถูกล้างเมื่อ restart)
+# ถ้าไม่ตั้งไว้ WAL จะปิด และการเขียนระหว่าง Firestore ล่มจะตอบว่าไม่สำเร็จแทน
+FIRESTORE_TIMEOUT = float(os.getenv("FIRESTORE_TIMEOUT", 2.0))
+FIRESTORE_LIST_TIMEOUT = float(os.getenv("FIRESTORE_LIST_TIMEOUT", 5.0))
+LEAVES_WAL_PATH = os.getenv("LEAVES_WAL_PATH")
+
+firestore_breaker = CircuitBreaker(
+    failure_threshold=int(os.getenv("FIRESTORE_BREAKER_THRESHOLD", 3)),
+    reset_timeout=float(os.getenv("FIRESTORE_BREAKER_RESET", 30))
+)
+leaves_wal = WriteAheadLog(LEAVES_WAL_PATH) if db and LEAVES_WAL_PATH else None
+if db and leaves_wal is None:
+    app.logger.warning("LEAVES_WAL_PATH is not set: WAL buffering is DISABLED, leave writes will fail "
+                       "while Firestore is unavailable. Set it to a file on a persistent disk.")
+# lid -> record ถูก set (True) หรือ delete (False) ใน WAL ที่ยังค้าง
+_wal_exists = {}
+# lid -> field ที่ update ค้างใน WAL สำหรับ record ที่อยู่ใน Firestore เท่านั้น (ไม่มีใน leaves_store)
+# ใช้ซ้อนทับตอนอ่าน เพื่อให้เห็นการแก้ไขก่อน replay
+_wal_updates = {}
+_local_lock = threading.Lock()
+_replay_guard = threading.Lock()
+_replay_thread = None
+
+def fs_call(fn, timeout=FIRESTORE_TIMEOUT):
+    # fn(**kw) ต้องส่ง kw (timeout/retry) ต่อให้ Firestore; NotFound แปลว่า Firestore ยังตอบได้
+    return firestore_breaker.call(lambda: fn(timeout=timeout, retry=None), ok_errors=(NotFound,))
+
+def wal_pending():
+    return bool(leaves_wal is not None and len(leaves_wal))
+
+def _apply_local(op, lid, data):
+    # leaves_store ในโหมด Firebase เก็บเฉพาะสถานะล่าสุดของ record ที่ยังค้างใน WAL
+    if op == "set":
+        _wal_exists[lid] = True
+        leaves_store[lid] = dict(data)
+        _wal_updates.pop(lid, None)
+    elif op == "update":
+        if lid in leaves_store:
+            leaves_store[lid].update(data)
+        else:
+            _wal_updates.setdefault(lid, {}).update(data)
+    elif op == "delete":
+        _wal_exists[lid] = False
+        leaves_store.pop(lid, None)
+        _wal_updates.pop(lid, None)
+
+def _queued_delete(lid):
+    return _wal_exists.get(lid) is False
+
+def _with_queued_updates(lid, data):
+    pending = _wal_updates.get(lid)
+    if pending:
+        data.update(pending)
+    return data
+
+def _wal_write(op, lid, data=None):
+    with _local_lock:
+        leaves_wal.append({"op": op, "id": lid, "data": data, "queued_at": datetime.utcnow().isoformat()})
+        _apply_local(op, lid, data)
+    app.logger.warning(f"Firestore unavailable, queued leave {op} {lid} in WAL")
+    _schedule_replay()
+
+def _replay_entry(entry):
+    # set/update ซ้ำได้อย่างปลอดภัย (เผื่อครั้งแรกที่ timeout จริง ๆ เขียนสำเร็จไปแล้ว)
+    ref = db.collection("leaves").document(entry["id"])
+    op = entry["op"]
+    try:
+        if op == "set":
+            fs_call(lambda **kw: ref.set(entry["data"], **kw))
+        elif op == "update":
+            fs_call(lambda **kw: ref.update(entry["data"], **kw))
+        elif op == "delete":
+            fs_call(lambda **kw: ref.delete(**kw))
+    except NotFound:
+        app.logger.warning(f"WAL replay: leave {entry['id']} no longer exists, dropping {op}")
+
+def replay_wal():
+    result = leaves_wal.replay(_replay_entry)
+    if result is None:
+        return
+    done, _ = result
+    with _local_lock:
+        if not len(leaves_wal):
+            leaves_store.clear()
+            _wal_exists.clear()
+            _wal_updates.clear()
+    app.logger.info(f"WAL replay: applied {done}, remaining {len(leaves_wal)}")
+
+def _schedule_replay():
+    # replay ใน background thread เพื่อไม่ให้ request ต้องรอ; ครั้งแรกหลัง breaker ครบเวลา
+    # คือการเรียกทดลอง (half-open) ที่จะปิด breaker ถ้าสำเร็จ
+    global _replay_thread
+    if not wal_pending() or firestore_breaker.state == OPEN:
+        return
+    with _replay_guard:
+        if _replay_thread is not None and _replay_thread.is_alive():
+            return
+        _replay_thread = threading.Thread(target=replay_wal, name="leaves-wal-replay", daemon=True)
+        _replay_thread.start()
+
+firestore_breaker.add_listener(lambda old, new: _schedule_replay() if new == CLOSED else None)
+
+if wal_pending():
+    # WAL จากรอบก่อน (restart ระหว่าง Firestore ล่ม): โหลดสถานะค้างกลับมาแล้ว replay
+    for _entry in leaves_wal.entries():
+        _apply_local(_entry["op"], _entry["id"], _entry.get("data"))
+    app.logger.warning(f"Found {len(leaves_wal)} pending WAL entries, replaying")
+    _schedule_replay()
+
+def _log_firestore_error(action, e):
+    if isinstance(e, CircuitOpenError):
+        return
+    app.logger.error(f"Failed to {action} in Firestore: {e}")
+
 # --- Firestore / In-memory CRUD helpers for 'leaves' ---
 def create_leave_record(record: dict):
     # record: dict with leave_type, leave_date, note, user_id, created_at (optional)
     if db:
-        try:
-            doc_ref = db.collection("leaves").document()
-            now = datetime.utcnow().isoformat()
-            record.setdefault("created_at", now)
-            doc_ref.set(record)
-            app.logger.info(f"Created leave in Firestore: {doc_ref.id}")
-            return doc_ref.id
-        except Exception as e:
-            app.logger.error(f"Failed to create leave in Firestore: {e}")
-            # fallback to in-memory
-    # in-memory fallback
+        record.setdefault("created_at", datetime.utcnow().isoformat())
+        doc_ref = db.collection("leaves").document()  # id สร้างฝั่ง client ใช้ต่อได้ตอน replay
+        # ถ้ายังมีการเขียนค้างใน WAL ต้องต่อคิวเพื่อรักษาลำดับ
+        if not wal_pending():
+            try:
+                fs_call(lambda **kw: doc_ref.set(record, **kw))
+                app.logger.info(f"Created leave in Firestore: {doc_ref.id}")
+                return doc_ref.id
+            except Exception as e:
+                _log_firestore_error("create leave", e)
+        if leaves_wal is None:
+            return None
+        _wal_write("set", doc_ref.id, record)
+        return doc_ref.id
+    # in-memory (ไม่มี Firebase)
     lid = str(uuid.uuid4())
     record.setdefault("created_at", datetime.utcnow().isoformat())
     leaves_store[lid] = record
     app.logger.info(f"Created leave in memory: {lid}")
     return lid
 
+def is_leave_queued(lid: str):
+    return db is not None and lid in leaves_store
+
 def get_leave_record(lid: str):
     if db:
-        try:
-            doc = db.collection("leaves").document(lid).get()
-            if doc.exists:
-                data = doc.to_dict()
-                data["id"] = doc.id
-                return data
+        _schedule_replay()
+        if _queued_delete(lid):
             return None
-        except Exception as e:
-            app.logger.error(f"Failed to read leave from Firestore: {e}")
-    # fallback in-memory
+        if not (wal_pending() and lid in leaves_store):
+            try:
+                doc = fs_call(lambda **kw: db.collection("leaves").document(lid).get(**kw))
+                if doc.exists:
+                    data = _with_queued_updates(lid, doc.to_dict())
+                    data["id"] = doc.id
+                    return data
+                return None
+            except Exception as e:
+                _log_firestore_error("read leave", e)
+    # in-memory หรือ record ที่ยังค้างใน WAL
     rec = leaves_store.get(lid)
     if rec:
         r = dict(rec)
@@ -192,17 +328,20 @@ def get_leave_record(lid: str):
 def list_leaves():
     results = []
     if db:
+        _schedule_replay()
         try:
-            docs = db.collection("leaves").order_by("created_at", direction=firestore.Query.DESCENDING).stream()
+            query = db.collection("leaves").order_by("created_at", direction=firestore.Query.DESCENDING)
+            docs = fs_call(lambda **kw: list(query.stream(**kw)), timeout=FIRESTORE_LIST_TIMEOUT)
             for d in docs:
-                item = d.to_dict()
+                if d.id in leaves_store or _queued_delete(d.id):
+                    continue
+                item = _with_queued_updates(d.id, d.to_dict())
                 item["id"] = d.id
                 results.append(item)
-            return results
         except Exception as e:
-            app.logger.error(f"Failed to list leaves from Firestore: {e}")
-    # fallback in-memory
-    for lid, rec in leaves_store.items():
+            _log_firestore_error("list leaves", e)
+    # in-memory หรือ record ที่ยังค้างใน WAL
+    for lid, rec in list(leaves_store.items()):
         item = dict(rec)
         item["id"] = lid
         results.append(item)
@@ -214,34 +353,48 @@ def list_leaves():
     return results
 
 def update_leave_record(lid: str, updates: dict):
+    # True = บันทึกแล้ว (หรือเข้า WAL), False = ไม่พบ record, None = Firestore ไม่พร้อมและรับเข้าคิวไม่ได้
+    # update/delete เข้า WAL โดยไม่อ่าน Firestore ก่อน: record ที่ไม่มีอยู่จริงจะถูกทิ้งตอน replay
+    updates["updated_at"] = datetime.utcnow().isoformat()
     if db:
-        try:
-            doc_ref = db.collection("leaves").document(lid)
-            if not doc_ref.get().exists:
+        if not wal_pending():
+            try:
+                # update() fails with NotFound for a missing document; no pre-read needed
+                fs_call(lambda **kw: db.collection("leaves").document(lid).update(updates, **kw))
+                return True
+            except NotFound:
                 return False
-            updates["updated_at"] = datetime.utcnow().isoformat()
-            doc_ref.update(updates)
-            return True
-        except Exception as e:
-            app.logger.error(f"Failed to update leave in Firestore: {e}")
-    # fallback in-memory
+            except Exception as e:
+                _log_firestore_error("update leave", e)
+        if leaves_wal is None:
+            return None
+        if _queued_delete(lid):
+            return False
+        _wal_write("update", lid, updates)
+        return True
+    # in-memory
     if lid in leaves_store:
         leaves_store[lid].update(updates)
-        leaves_store[lid]["updated_at"] = datetime.utcnow().isoformat()
         return True
     return False
 
 def delete_leave_record(lid: str):
     if db:
-        try:
-            doc_ref = db.collection("leaves").document(lid)
-            if not doc_ref.get().exists:
+        if not wal_pending():
+            try:
+                fs_call(lambda **kw: db.collection("leaves").document(lid).delete(option=db.write_option(exists=True), **kw))
+                return True
+            except NotFound:
                 return False
-            doc_ref.delete()
-            return True
-        except Exception as e:
-            app.logger.error(f"Failed to delete leave in Firestore: {e}")
-    # fallback in-memory
+            except Exception as e:
+                _log_firestore_error("delete leave", e)
+        if leaves_wal is None:
+            return None
+        if _queued_delete(lid):
+            return False
+        _wal_write("delete", lid)
+        return True
+    # in-memory
     if lid in leaves_store:
         del leaves_store[lid]
         return True
@@ -267,6 +420,8 @@ def api_create_leave():
         "user_id": user_id
     }
     lid = create_leave_record(rec)
+    if lid is None:
+        return jsonify({"error": "Firestore unavailable, leave not saved"}), 503
     return jsonify({"id": lid, "record": rec}), 201
 
 @app.route("/api/leaves", methods=["GET"])
@@ -291,15 +446,19 @@ def api_update_leave(lid):
     if not payload:
         return jsonify({"error": "No updatable fields provided"}), 400
     ok = update_leave_record(lid, payload)
+    if ok is None:
+        return jsonify({"error": "Firestore unavailable, update not saved"}), 503
     if not ok:
-        return jsonify({"error": "not found or update failed"}), 404
+        return jsonify({"error": "not found"}), 404
     return jsonify({"id": lid, "updated": payload}), 200
 
 @app.route("/api/leaves/<lid>", methods=["DELETE"])
 def api_delete_leave(lid):
     ok = delete_leave_record(lid)
+    if ok is None:
+        return jsonify({"error": "Firestore unavailable, delete not saved"}), 503
     if not ok:
-        return jsonify({"error": "not found or delete failed"}), 404
+        return jsonify({"error": "not found"}), 404
     return jsonify({"id": lid, "deleted": True}), 200
 
 # --- Simple CRUD for personnel (in-memory) ---
@@ -341,6 +500,130 @@ def api_delete_personnel(pid):
     name = personnel_list.pop(idx)
     return jsonify({"id": pid, "name": name, "deleted": True}), 200
 
+# --- Reply templates ---
+# สร้างครั้งเดียวตอนโหลดโมดูลแล้วใช้ซ้ำทุกข้อความ (ห้ามแก้ไขภายหลัง)
+LEAVE_TYPES = ("ลาพัก", "ลากิจ", "ลาป่วย", "ราชการ")
+CANCEL_BUTTON = QuickReplyButton(action=MessageAction(label="❌ ยกเลิก", text="#ยกเลิก"))
+LEAVE_TYPE_REPLY = TextSendMessage(
+    text="กรุณาเลือกประเภทการลาครับ",
+    quick_reply=QuickReply(items=tuple(QuickReplyButton(action=MessageAction(label=t, text=t)) for t in LEAVE_TYPES) + (CANCEL_BUTTON,))
+)
+LEAVE_DATE_REPLY = TextSendMessage(
+    text="กรุณาระบุวันที่ลา (พิมพ์ YYYY-MM-DD หรือเลือกวันนี้/พรุ่งนี้)",
+    quick_reply=QuickReply(items=(
+        QuickReplyButton(action=MessageAction(label="วันนี้", text="วันนี้")),
+        QuickReplyButton(action=MessageAction(label="พรุ่งนี้", text="พรุ่งนี้")),
+        CANCEL_BUTTON
+    ))
+)
+LEAVE_NOTE_REPLY = TextSendMessage(text="กรุณาระบุหมายเหตุ/เหตุผลการลา (หรือพิมพ์ - หากไม่ต้องการใส่)")
+BAD_LEAVE_TYPE_REPLY = TextSendMessage(text="ไม่พบประเภทการลา กรุณาเลือกอีกครั้ง หรือพิมพ์ #ยกเลิก เพื่อยกเลิก")
+BAD_DATE_REPLY = TextSendMessage(text="รูปแบบวันที่ไม่ถูกต้อง กรุณาพิมพ์ YYYY-MM-DD หรือเลือก 'วันนี้'/'พรุ่งนี้'")
+CANCELLED_REPLY = TextSendMessage(text="❌ ยกเลิกคำสั่งเรียบร้อยแล้ว")
+RESET_REPLY = TextSendMessage(text="🔄️ รีเซ็ตเรียบร้อยแล้วครับ")
+HELP_REPLY = TextSendMessage(text=(
+    "สวัสดีครับ 👋\n"
+    "คำสั่งที่ใช้งานได้:\n"
+    "- #แจ้งลา : เริ่มกระบวนการแจ้งลา\n"
+    "- #ยกเลิก : ยกเลิกคำสั่งปัจจุบัน\n"
+    "- #รีเซ็ต : รีเซ็ตสถานะของคุณ\n"
+    "- #ช่วยเหลือ : แสดงคำสั่งทั้งหมด\n\n"
+    "นอกจากนี้มี API CRUD สำหรับ leaves และ personnel ที่ /api/…"
+))
+
+def reply(event, message):
+    line_bot_api.reply_message(event.reply_token, message)
+
+# --- คำสั่ง (ไม่ต้องอ่านสถานะผู้ใช้) ---
+def command_cancel(event, user_id, text):
+    user_states.pop(user_id, None)
+    reply(event, CANCELLED_REPLY)
+
+def command_reset(event, user_id, text):
+    user_states.pop(user_id, None)
+    reply(event, RESET_REPLY)
+
+def command_request_leave(event, user_id, text):
+    user_states[user_id] = {"step": "awaiting_leave_type", "data": {}}
+    reply(event, LEAVE_TYPE_REPLY)
+
+def command_help(event, user_id, text):
+    reply(event, HELP_REPLY)
+
+COMMANDS = {
+    "#ยกเลิก": command_cancel,
+    "#รีเซ็ต": command_reset,
+    "#แจ้งลา": command_request_leave,
+    "#ช่วยเหลือ": command_help,
+    "#help": command_help,
+}
+
+# --- ขั้นตอนแจ้งลา (หนึ่งฟังก์ชันต่อหนึ่ง step) ---
+def step_leave_type(event, user_id, state, text):
+    # มักจะได้จาก quick reply
+    if text.lower() not in LEAVE_TYPES:
+        reply(event, BAD_LEAVE_TYPE_REPLY)
+        return
+    state["data"]["type"] = text
+    state["step"] = "awaiting_leave_date"
+    reply(event, LEAVE_DATE_REPLY)
+
+def step_leave_date(event, user_id, state, text):
+    try:
+        if text == "วันนี้":
+            leave_date = datetime.utcnow().date()
+        elif text == "พรุ่งนี้":
+            leave_date = (datetime.utcnow().date() + timedelta(days=1))
+        else:
+            leave_date = datetime.strptime(text, "%Y-%m-%d").date()
+    except ValueError:
+        reply(event, BAD_DATE_REPLY)
+        return
+    state["data"]["date"] = leave_date.isoformat()
+    state["step"] = "awaiting_leave_note"
+    reply(event, LEAVE_NOTE_REPLY)
+
+def step_leave_note(event, user_id, state, text):
+    note = text if text != "-" else ""
+    state["data"]["note"] = note
+    # สร้าง record
+    rec = {
+        "user_id": user_id,
+        "leave_type": state["data"].get("type"),
+        "leave_date": state["data"].get("date"),
+        "note": note,
+        "created_at": datetime.utcnow().isoformat()
+    }
+    lid = create_leave_record(rec)
+    if lid is None:
+        # คงสถานะไว้ ส่งหมายเหตุอีกครั้งเพื่อลองใหม่
+        reply(event, TextSendMessage(text="❌ Firebase ไม่พร้อมชั่วคราว ยังไม่ได้บันทึกการลา กรุณาส่งหมายเหตุอีกครั้งภายหลัง"))
+        return
+    # ตอบยืนยัน
+    text_lines = [
+        "✅ บันทึกการลาเรียบร้อยแล้ว",
+        f"ID: {lid}",
+        f"ประเภท: {rec['leave_type']}",
+        f"วันที่: {rec['leave_date']}",
+    ]
+    if note:
+        text_lines.append(f"หมายเหตุ: {note}")
+    if is_leave_queued(lid):
+        text_lines.append("(Firebase ไม่พร้อมชั่วคราว — บันทึกไว้ในเครื่องแล้ว จะส่งขึ้น Firebase อัตโนมัติ)")
+    elif db:
+        text_lines.append("(บันทึกลง Firebase เรียบร้อยแล้ว)")
+    else:
+        text_lines.append("(บันทึกลงหน่วยความจำในเครื่อง — ไม่ถาวร)")
+    # ล้างสถานะ
+    user_states.pop(user_id, None)
+    reply(event, TextSendMessage(text="\n".join(text_lines)))
+
+STEPS = {
+    "awaiting_leave_type": step_leave_type,
+    "awaiting_leave_date": step_leave_date,
+    "awaiting_leave_note": step_leave_note,
+}
+
 # --- Message Event Handler ---
 @handler.add(MessageEvent, message=TextMessage)
 def handle_message(event):
@@ -348,116 +631,21 @@ def handle_message(event):
     user_message = (event.message.text or "").strip()
     app.logger.info(f"[message] from {user_id}: {user_message}")
 
-    # คำสั่งยกเลิก
-    if user_message == "#ยกเลิก":
-        if user_id in user_states:
-            del user_states[user_id]
-        line_bot_api.reply_message(event.reply_token, TextSendMessage(text="❌ ยกเลิกคำสั่งเรียบร้อยแล้ว"))
+    # คำสั่งตอบได้ทันทีโดยไม่ต้องดูสถานะ
+    command = COMMANDS.get(user_message)
+    if command:
+        command(event, user_id, user_message)
         return
 
-    # คำสั่งเริ่มต้นแจ้งลา
-    if user_message == "#แจ้งลา":
-        user_states[user_id] = {"step": "awaiting_leave_type", "data": {}}
-        leave_buttons = [
-            QuickReplyButton(action=MessageAction(label="ลาพัก", text="ลาพัก")),
-            QuickReplyButton(action=MessageAction(label="ลากิจ", text="ลากิจ")),
-            QuickReplyButton(action=MessageAction(label="ลาป่วย", text="ลาป่วย")),
-            QuickReplyButton(action=MessageAction(label="ราชการ", text="ราชการ")),
-            QuickReplyButton(action=MessageAction(label="❌ ยกเลิก", text="#ยกเลิก"))
-        ]
-        reply_msg = TextSendMessage(text="กรุณาเลือกประเภทการลาครับ", quick_reply=QuickReply(items=leave_buttons))
-        line_bot_api.reply_message(event.reply_token, reply_msg)
+    # ถ้ามีสถานะรันอยู่ ให้จัดการ flow ตาม step
+    state = user_states.get(user_id)
+    step_handler = STEPS.get(state.get("step", "")) if state else None
+    if step_handler:
+        step_handler(event, user_id, state, user_message)
         return
 
-    # รีเซ็ตสถานะสำหรับผู้ใช้
-    if user_message == "#รีเซ็ต":
-        if user_id in user_states:
-            del user_states[user_id]
-        line_bot_api.reply_message(event.reply_token, TextSendMessage(text="🔄️ รีเซ็ตเรียบร้อยแล้วครับ"))
-        return
-
-    # ถ้ามีสถานะรันอยู่ ให้จัดการ flow
-    if user_id in user_states:
-        state = user_states[user_id]
-        step = state.get("step", "")
-        # ถ้ารอประเภทการลา (มักจะได้จาก quick reply)
-        if step == "awaiting_leave_type":
-            leave_type = user_message
-            if leave_type.lower() in ("ลาพัก", "ลากิจ", "ลาป่วย", "ราชการ"):
-                state["data"]["type"] = leave_type
-                state["step"] = "awaiting_leave_date"
-                quicks = [
-                    QuickReplyButton(action=MessageAction(label="วันนี้", text="วันนี้")),
-                    QuickReplyButton(action=MessageAction(label="พรุ่งนี้", text="พรุ่งนี้")),
-                    QuickReplyButton(action=MessageAction(label="❌ ยกเลิก", text="#ยกเลิก"))
-                ]
-                line_bot_api.reply_message(
-                    event.reply_token,
-                    TextSendMessage(text="กรุณาระบุวันที่ลา (พิมพ์ YYYY-MM-DD หรือเลือกวันนี้/พรุ่งนี้)", quick_reply=QuickReply(items=quicks))
-                )
-            else:
-                line_bot_api.reply_message(event.reply_token, TextSendMessage(text="ไม่พบประเภทการลา กรุณาเลือกอีกครั้ง หรือพิมพ์ #ยกเลิก เพื่อยกเลิก"))
-            return
-
-        # ถ้ารอวันที่
-        if step == "awaiting_leave_date":
-            date_text = user_message
-            try:
-                if date_text == "วันนี้":
-                    leave_date = datetime.utcnow().date()
-                elif date_text == "พรุ่งนี้":
-                    leave_date = (datetime.utcnow().date() + timedelta(days=1))
-                else:
-                    leave_date = datetime.strptime(date_text, "%Y-%m-%d").date()
-                state["data"]["date"] = leave_date.isoformat()
-                state["step"] = "awaiting_leave_note"
-                line_bot_api.reply_message(event.reply_token, TextSendMessage(text="กรุณาระบุหมายเหตุ/เหตุผลการลา (หรือพิมพ์ - หากไม่ต้องการใส่)"))
-            except Exception:
-                line_bot_api.reply_message(event.reply_token, TextSendMessage(text="รูปแบบวันที่ไม่ถูกต้อง กรุณาพิมพ์ YYYY-MM-DD หรือเลือก 'วันนี้'/'พรุ่งนี้'"))
-            return
-
-        # ถ้ารอหมายเหตุ
-        if step == "awaiting_leave_note":
-            note = user_message if user_message != "-" else ""
-            state["data"]["note"] = note
-            # สร้าง record
-            rec = {
-                "user_id": user_id,
-                "leave_type": state["data"].get("type"),
-                "leave_date": state["data"].get("date"),
-                "note": note,
-                "created_at": datetime.utcnow().isoformat()
-            }
-            lid = create_leave_record(rec)
-            # ตอบยืนยัน
-            text_lines = [
-                "✅ บันทึกการลาเรียบร้อยแล้ว",
-                f"ID: {lid}",
-                f"ประเภท: {rec['leave_type']}",
-                f"วันที่: {rec['leave_date']}",
-            ]
-            if note:
-                text_lines.append(f"หมายเหตุ: {note}")
-            if db:
-                text_lines.append("(บันทึกลง Firebase เรียบร้อยแล้ว)")
-            else:
-                text_lines.append("(บันทึกลงหน่วยความจำในเครื่อง — ไม่ถาวร)")
-            # ล้างสถานะ
-            if user_id in user_states:
-                del user_states[user_id]
-            line_bot_api.reply_message(event.reply_token, TextSendMessage(text="\n".join(text_lines)))
-            return
-
     # ถ้าไม่มี flow ใด ๆ ให้ตอบ help message
-    help_text = (
-        "สวัสดีครับ 👋\n"
-        "คำสั่งที่ใช้งานได้:\n"
-        "- #แจ้งลา : เริ่มกระบวนการแจ้งลา\n"
-        "- #ยกเลิก : ยกเลิกคำสั่งปัจจุบัน\n"
-        "- #รีเซ็ต : รีเซ็ตสถานะของคุณ\n\n"
-        "นอกจากนี้มี API CRUD สำหรับ leaves และ personnel ที่ /api/…"
-    )
-    line_bot_api.reply_message(event.reply_token, TextSendMessage(text=help_text))
+    reply(event, HELP_REPLY)
 
 
 # --- Postback Event Handler ---
@@ -0,0 +1,112 @@
+# image_cache.py - bounded LRU for rendered images: memory first, then disk
+#
+# The disk level lives under IMAGE_DIR and is only a cache; everything in it can be
+# rendered again from Firestore, so losing it on a restart costs a render, never a
+# broken link.
+import hashlib
+import os
+import threading
+import uuid
+from collections import OrderedDict
+
+
+class ImageCache:
+
+    def __init__(self, max_memory_bytes=16 * 1024 * 1024, disk_dir=None, max_disk_bytes=256 * 1024 * 1024):
+        self.max_memory_bytes = max_memory_bytes
+        self.max_disk_bytes = max_disk_bytes
+        self.disk_dir = disk_dir
+        self._lock = threading.Lock()
+        self._memory = OrderedDict()
+        self._memory_bytes = 0
+        self._disk = OrderedDict()  # file name -> size, least recently used first
+        self._disk_bytes = 0
+        self._counters = {"memory_hits": 0, "disk_hits": 0, "misses": 0}
+        if disk_dir:
+            os.makedirs(disk_dir, exist_ok=True)
+            entries = []
+            for name in os.listdir(disk_dir):
+                path = os.path.join(disk_dir, name)
+                if name.endswith(".img") and os.path.isfile(path):
+                    st = os.stat(path)
+                    entries.append((st.st_mtime, name, st.st_size))
+            for _, name, size in sorted(entries):
+                self._disk[name] = size
+                self._disk_bytes += size
+
+    @staticmethod
+    def _filename(key):
+        return hashlib.sha1(repr(key).encode("utf-8")).hexdigest() + ".img"
+
+    def get(self, key):
+        with self._lock:
+            data = self._memory.get(key)
+            if data is not None:
+                self._memory.move_to_end(key)
+                self._counters["memory_hits"] += 1
+                return data
+            name = self._filename(key)
+            on_disk = self.disk_dir and name in self._disk
+            if on_disk:
+                self._disk.move_to_end(name)
+        if on_disk:
+            try:
+                with open(os.path.join(self.disk_dir, name), "rb") as f:
+                    data = f.read()
+            except OSError:
+                data = None
+            if data is not None:
+                with self._lock:
+                    self._counters["disk_hits"] += 1
+                    self._remember(key, data)
+                return data
+        with self._lock:
+            self._counters["misses"] += 1
+        return None
+
+    def _remember(self, key, data):
+        # caller holds the lock
+        old = self._memory.pop(key, None)
+        if old is not None:
+            self._memory_bytes -= len(old)
+        self._memory[key] = data
+        self._memory_bytes += len(data)
+        while self._memory_bytes > self.max_memory_bytes and len(self._memory) > 1:
+            _, evicted = self._memory.popitem(last=False)
+            self._memory_bytes -= len(evicted)
+
+    def put(self, key, data):
+        with self._lock:
+            self._remember(key, data)
+        if not self.disk_dir:
+            return
+        name = self._filename(key)
+        path = os.path.join(self.disk_dir, name)
+        tmp_path = f"{path}.{uuid.uuid4().hex[:8]}.tmp"
+        try:
+            with open(tmp_path, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except OSError:
+            return
+        evict = []
+        with self._lock:
+            self._disk_bytes -= self._disk.pop(name, 0)
+            self._disk[name] = len(data)
+            self._disk_bytes += len(data)
+            while self._disk_bytes > self.max_disk_bytes and len(self._disk) > 1:
+                old_name, size = self._disk.popitem(last=False)
+                self._disk_bytes -= size
+                evict.append(old_name)
+        for old_name in evict:
+            try:
+                os.remove(os.path.join(self.disk_dir, old_name))
+            except OSError:
+                pass
+
+    def stats(self):
+        with self._lock:
+            data = dict(self._counters)
+            data.update(memory_entries=len(self._memory), memory_bytes=self._memory_bytes,
+                        disk_entries=len(self._disk), disk_bytes=self._disk_bytes)
+        return data
@@ -0,0 +1,45 @@
+# image_encoding.py - compact PNG encoding and preview variants for LINE image messages
+#
+# The cards and calendars are flat colours plus anti-aliased text, so a 64-colour
+# palette without dithering is visually lossless and compresses far better than
+# 24-bit RGB. LINE image messages accept only JPEG and PNG, so no WebP variant.
+import io
+
+try:
+    from PIL import Image
+except Exception:
+    Image = None
+
+ORIGINAL_MAX_BYTES = 300 * 1024
+PREVIEW_MAX_BYTES = 40 * 1024
+PREVIEW_SIZE = 240
+PALETTE_STEPS = (64, 32, 16)
+
+
+def _quantize(img, colors):
+    method = getattr(getattr(Image, "Quantize", Image), "FASTOCTREE", 2)
+    dither = getattr(getattr(Image, "Dither", Image), "NONE", 0)
+    return img.convert("RGB").quantize(colors=colors, method=method, dither=dither)
+
+
+def encode_png(img, max_bytes=ORIGINAL_MAX_BYTES, palette_steps=PALETTE_STEPS):
+    # Fewer colours until the encoded size fits max_bytes; the last step is used as-is
+    data = None
+    for colors in palette_steps:
+        buf = io.BytesIO()
+        _quantize(img, colors).save(buf, format="PNG", optimize=True)
+        data = buf.getvalue()
+        if len(data) <= max_bytes:
+            break
+    return data
+
+
+def make_preview(img, size=PREVIEW_SIZE, max_bytes=PREVIEW_MAX_BYTES):
+    thumb = img.convert("RGB")
+    thumb.thumbnail((size, size), getattr(getattr(Image, "Resampling", Image), "LANCZOS"))
+    return encode_png(thumb, max_bytes=max_bytes)
+
+
+def encode_variants(img):
+    # (original, preview) PNG bytes for an ImageSendMessage, from one rendered image
+    return encode_png(img), make_preview(img)
@@ -0,0 +1,100 @@
+# leave_image.py - leave request summary card (sent after #แจ้งลา)
+from text_layout import TextMeasurer
+
+try:
+    from PIL import Image, ImageDraw, ImageFont
+except Exception:
+    Image = ImageDraw = ImageFont = None
+
+WIDTH = 650
+HEIGHT = 480  # minimum; long values wrap and the card grows
+VALUE_X = 300
+TOP = 110
+ROW_GAP = 10
+LINE_HEIGHT = 26
+BOTTOM = 50
+BACKGROUND = "#F0F4F8"
+TITLE = "ใบแจ้งลาอิเล็กทรอนิกส์"
+FONT_SIZES = (36, 20, 18)
+STATUS_LABELS = {
+    "Pending": "รอการอนุมัติ (Pending)",
+    "Approved": "อนุมัติแล้ว (Approved)",
+    "Rejected": "ไม่อนุมัติ (Rejected)"
+}
+# leave document fields the card depends on
+SUMMARY_FIELDS = ("leave_type", "personnel_name", "start_date", "end_date", "duration_days", "reason", "status")
+
+
+def summary_lines(data):
+    status = data.get('status') or "Pending"
+    return [
+        ("ประเภทการลา:", data.get('leave_type', '-')),
+        ("ชื่อผู้ลา:", data.get('personnel_name', '-')),
+        ("วันที่เริ่มต้น:", data.get('start_date', '-')),
+        ("วันที่สิ้นสุด:", data.get('end_date', '-')),
+        ("รวมระยะเวลา:", f"{data.get('duration_days', '-')} วัน"),
+        ("เหตุผล:", data.get('reason', '-')),
+        ("สถานะ:", STATUS_LABELS.get(status, status))
+    ]
+
+
+def summary_text(data):
+    # Text version of the card, for when the image can't be shown
+    return "\n".join(f"{key} {value}" for key, value in summary_lines(data))
+
+
+class LeaveSummaryRenderer:
+
+    def __init__(self, font_path=None):
+        self.font_path = font_path
+        self._fonts = {}
+        self._measurers = {}
+
+    def font(self, size):
+        if size not in self._fonts:
+            loaded = None
+            if self.font_path:
+                try:
+                    loaded = ImageFont.truetype(self.font_path, size)
+                except Exception:
+                    loaded = None
+            self._fonts[size] = loaded or ImageFont.load_default()
+        return self._fonts[size]
+
+    def measurer(self, size):
+        if size not in self._measurers:
+            self._measurers[size] = TextMeasurer(self.font(size))
+        return self._measurers[size]
+
+    def layout(self, data):
+        # [(key, wrapped value lines, y)] and the canvas height they need
+        measure = self.measurer(FONT_SIZES[2])
+        value_width = WIDTH - VALUE_X - 50
+        rows = []
+        y = TOP
+        for key, value in summary_lines(data):
+            lines = measure.wrap(str(value), value_width) or [""]
+            rows.append((key, lines, y))
+            y += max(36, len(lines) * LINE_HEIGHT + ROW_GAP)
+        return rows, max(HEIGHT, y + BOTTOM)
+
+    def warm(self):
+        for size in FONT_SIZES:
+            self.font(size)
+
+    def render(self, data):
+        rows, height = self.layout(data)
+        img = Image.new('RGB', (WIDTH, height), color=BACKGROUND)
+        d = ImageDraw.Draw(img)
+        font_title, font_header, font_body = (self.font(size) for size in FONT_SIZES)
+        d.rectangle((20, 20, WIDTH - 20, height - 20), fill='#FFFFFF', outline='#007BFF', width=3)
+        try:
+            d.text((WIDTH / 2, 40), TITLE, fill=(25, 25, 112), font=font_title, anchor="mt")
+        except Exception:
+            tw = self.measurer(FONT_SIZES[0]).width(TITLE)
+            d.text(((WIDTH - tw) / 2, 40), TITLE, fill=(25, 25, 112), font=font_title)
+        for key, lines, y in rows:
+            d.text((50, y), key, fill=(50, 50, 50), font=font_header)
+            for i, line in enumerate(lines):
+                d.text((VALUE_X, y + i * LINE_HEIGHT), line, fill=(0, 0, 0), font=font_body)
+        return img
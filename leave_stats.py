@@ -0,0 +1,179 @@
+# leave_stats.py - per-person, per-year leave counters kept in step with leave writes
+#
+# One document per (personnel_name, year) holds, for each leave type and status, the
+# number of leaves starting in that year and the number of leave days falling in it:
+#   {"personnel_name": "...", "year": 2025,
+#    "by_type": {"ลาป่วย": {"Approved": {"count": 1, "days": 3}}}}
+# Leave writes go through LeaveStats, which reads the leave's previous state and the
+# affected counter documents in a transaction and writes the leave together with the
+# adjusted counters, so a balance check is a single document read.
+import hashlib
+from datetime import date
+
+from firebase_admin import firestore
+from google.api_core.exceptions import NotFound
+
+from models import Leave
+
+DEFAULT_STATUS = "Pending"
+
+
+def stats_doc_id(personnel_name, year):
+    # names may contain '/', which is not allowed in a document id
+    digest = hashlib.sha1(personnel_name.encode("utf-8")).hexdigest()[:16]
+    return f"{year}_{digest}"
+
+
+def leave_contributions(leave):
+    # {(personnel_name, year): (count, days)}; a leave spanning New Year splits its
+    # days between the two years and counts once, in its start year
+    if (leave is None or not leave.has_valid_dates or leave.end_ord < leave.start_ord
+            or not leave.personnel_name or not leave.leave_type):
+        return {}
+    start_year = date.fromordinal(leave.start_ord).year
+    end_year = date.fromordinal(leave.end_ord).year
+    out = {}
+    for year in range(start_year, end_year + 1):
+        first = max(leave.start_ord, date(year, 1, 1).toordinal())
+        last = min(leave.end_ord, date(year, 12, 31).toordinal())
+        out[(leave.personnel_name, year)] = (1 if year == start_year else 0, last - first + 1)
+    return out
+
+
+def add_deltas(deltas, data, sign):
+    # Accumulate one leave document's contribution into
+    # {(personnel_name, year): {(leave_type, status): [count, days]}}
+    if data is None:
+        return deltas
+    leave = Leave.from_dict(data)
+    cell_key = (leave.leave_type, leave.status or DEFAULT_STATUS)
+    for doc_key, (count, days) in leave_contributions(leave).items():
+        cell = deltas.setdefault(doc_key, {}).setdefault(cell_key, [0, 0])
+        cell[0] += sign * count
+        cell[1] += sign * days
+    return deltas
+
+
+def _drop_noops(deltas):
+    # an update that only touched e.g. the reason leaves every counter unchanged
+    out = {}
+    for doc_key, cells in deltas.items():
+        cells = {k: v for k, v in cells.items() if v[0] or v[1]}
+        if cells:
+            out[doc_key] = cells
+    return out
+
+
+def apply_deltas(doc, personnel_name, year, cells):
+    doc = doc or {}
+    by_type = doc.get("by_type") or {}
+    for (leave_type, status), (count, days) in cells.items():
+        statuses = by_type.setdefault(leave_type, {})
+        cell = statuses.setdefault(status, {"count": 0, "days": 0})
+        cell["count"] += count
+        cell["days"] += days
+        if cell["count"] <= 0 and cell["days"] <= 0:
+            del statuses[status]
+        if not statuses:
+            del by_type[leave_type]
+    return {"personnel_name": personnel_name, "year": year, "by_type": by_type,
+            "updated_at": firestore.SERVER_TIMESTAMP}
+
+
+def days_taken(doc, leave_type, status):
+    cell = ((doc or {}).get("by_type") or {}).get(leave_type, {}).get(status) or {}
+    return cell.get("days", 0)
+
+
+class LeaveStats:
+
+    def __init__(self, db, leave_collection, stats_collection):
+        self.db = db
+        self.leave_collection = leave_collection
+        self.stats_collection = stats_collection
+
+    def _stats_ref(self, personnel_name, year):
+        return self.db.collection(self.stats_collection).document(stats_doc_id(personnel_name, year))
+
+    def _run(self, refs, new_state, write):
+        # new_state(ref, old_data) -> leave data after the write (None once deleted);
+        # write(transaction, ref) queues the leave write. All reads happen before
+        # any write, as Firestore transactions require. Returns the new states in
+        # the order of refs.
+        @firestore.transactional
+        def run(transaction):
+            snaps = {snap.id: snap for snap in transaction.get_all(refs)}
+            deltas = {}
+            states = []
+            for ref in refs:
+                snap = snaps.get(ref.id)
+                old = snap.to_dict() if snap is not None and snap.exists else None
+                new = new_state(ref, old)
+                states.append(new)
+                add_deltas(deltas, old, -1)
+                add_deltas(deltas, new, 1)
+            deltas = _drop_noops(deltas)
+            stat_refs = {key: self._stats_ref(*key) for key in deltas}
+            current = {}
+            if stat_refs:
+                current = {snap.id: snap.to_dict() for snap in transaction.get_all(list(stat_refs.values())) if snap.exists}
+            for ref in refs:
+                write(transaction, ref)
+            for (name, year), cells in deltas.items():
+                ref = stat_refs[(name, year)]
+                transaction.set(ref, apply_deltas(current.get(ref.id), name, year, cells))
+            return states
+        return run(self.db.transaction())
+
+    def create(self, ref, data):
+        return self._run([ref], lambda ref, old: data, lambda t, ref: t.set(ref, data))
+
+    def update(self, refs, payload):
+        # Applies the same field update to every leave in refs and returns the updated
+        # documents; NotFound if one is missing
+        def new_state(ref, old):
+            if old is None:
+                raise NotFound(f"{self.leave_collection}/{ref.id}")
+            return {**old, **payload}
+        return self._run(refs, new_state, lambda t, ref: t.update(ref, payload))
+
+    def delete(self, ref):
+        def new_state(ref, old):
+            if old is None:
+                raise NotFound(f"{self.leave_collection}/{ref.id}")
+            return None
+        return self._run([ref], new_state, lambda t, ref: t.delete(ref))
+
+    def get(self, personnel_name, year):
+        snap = self._stats_ref(personnel_name, year).get()
+        return snap.to_dict() if snap.exists else None
+
+    def list(self, year):
+        docs = self.db.collection(self.stats_collection).where("year", "==", year).stream()
+        return sorted((doc.to_dict() for doc in docs), key=lambda d: d.get("personnel_name") or "")
+
+    def rebuild(self, archived=()):
+        # Recompute every counter document from the leave collection plus any
+        # archived leave records (backfill, or repair after writes that bypassed
+        # LeaveStats). Run it while leaves are not being edited: it is a full scan,
+        # not a transaction.
+        totals = {}
+        for doc in self.db.collection(self.leave_collection).stream():
+            add_deltas(totals, doc.to_dict(), 1)
+        for data in archived:
+            add_deltas(totals, data, 1)
+        totals = _drop_noops(totals)
+        wanted = {stats_doc_id(name, year): (name, year, cells) for (name, year), cells in totals.items()}
+        stale = [doc.reference for doc in self.db.collection(self.stats_collection).stream() if doc.id not in wanted]
+        ops = [(doc_id, item) for doc_id, item in wanted.items()] + [(ref, None) for ref in stale]
+        for i in range(0, len(ops), 500):
+            batch = self.db.batch()
+            for target, item in ops[i:i + 500]:
+                if item is None:
+                    batch.delete(target)
+                else:
+                    name, year, cells = item
+                    batch.set(self.db.collection(self.stats_collection).document(target),
+                              apply_deltas(None, name, year, cells))
+            batch.commit()
+        return {"documents": len(wanted), "removed": len(stale)}
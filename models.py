@@ -0,0 +1,111 @@
+# models.py - compact records for personnel, leaves and duty definitions
+#
+# Firestore documents are converted once at load time: known fields become slots,
+# dates are parsed into ordinals (so hot loops compare ints), repeated strings are
+# interned, and anything else is kept in `extra` so to_dict() round-trips the
+# original document.
+import sys
+from datetime import date, datetime
+
+
+def _intern(value):
+    return sys.intern(value) if isinstance(value, str) else value
+
+
+def date_to_ordinal(value):
+    # 'YYYY-MM-DD' (or a date) -> ordinal int; None when missing or malformed
+    if isinstance(value, date):
+        return value.toordinal()
+    try:
+        return datetime.strptime(value, "%Y-%m-%d").date().toordinal()
+    except (TypeError, ValueError):
+        return None
+
+
+def ordinal_to_iso(ordinal):
+    return date.fromordinal(ordinal).isoformat()
+
+
+class Record:
+    __slots__ = ("doc_id", "extra")
+    FIELDS = ()
+    INTERNED = ()
+
+    def __init__(self, doc_id=None, extra=None, **fields):
+        self.doc_id = doc_id
+        self.extra = extra or None
+        for name in self.FIELDS:
+            value = fields.get(name)
+            setattr(self, name, _intern(value) if name in self.INTERNED else value)
+
+    @classmethod
+    def from_dict(cls, data, doc_id=None):
+        data = data or {}
+        fields = {}
+        extra = {}
+        for key, value in data.items():
+            if key in cls.FIELDS and value is not None:
+                fields[key] = value
+            elif key != "doc_id":
+                extra[key] = value
+        return cls(doc_id=data.get("doc_id") or doc_id, extra=extra, **fields)
+
+    @classmethod
+    def from_doc(cls, doc):
+        return cls.from_dict(doc.to_dict(), doc.id)
+
+    def to_firestore(self):
+        data = {name: getattr(self, name) for name in self.FIELDS if getattr(self, name) is not None}
+        if self.extra:
+            data.update(self.extra)
+        if self.doc_id:
+            data["doc_id"] = self.doc_id
+        return data
+
+    def to_dict(self):
+        # JSON/API shape: the stored document plus doc_id
+        return self.to_firestore()
+
+    def replace(self, **changes):
+        doc_id = changes.pop("doc_id", self.doc_id)
+        fields = {name: getattr(self, name) for name in self.FIELDS}
+        fields.update(changes)
+        return type(self)(doc_id=doc_id, extra=self.extra, **fields)
+
+    def __repr__(self):
+        return f"{type(self).__name__}({self.to_firestore()!r})"
+
+
+class Personnel(Record):
+    __slots__ = ("name", "duty_priority", "line_id")
+    FIELDS = ("name", "duty_priority", "line_id")
+    INTERNED = ("name",)
+
+    @property
+    def sort_priority(self):
+        return 999 if self.duty_priority is None else self.duty_priority
+
+
+class Duty(Record):
+    __slots__ = ("duty_name", "color", "priority")
+    FIELDS = ("duty_name", "color", "priority")
+    INTERNED = ("duty_name", "color")
+
+
+class Leave(Record):
+    __slots__ = ("personnel_name", "leave_type", "start_date", "end_date", "status", "line_id",
+                 "start_ord", "end_ord")
+    FIELDS = ("personnel_name", "leave_type", "start_date", "end_date", "status", "line_id")
+    INTERNED = ("personnel_name", "leave_type", "status")
+
+    def __init__(self, doc_id=None, extra=None, **fields):
+        super().__init__(doc_id=doc_id, extra=extra, **fields)
+        self.start_ord = date_to_ordinal(self.start_date)
+        self.end_ord = date_to_ordinal(self.end_date)
+
+    @property
+    def has_valid_dates(self):
+        return self.start_ord is not None and self.end_ord is not None
+
+    def covers(self, ordinal):
+        return self.has_valid_dates and self.start_ord <= ordinal <= self.end_ord
@@ -0,0 +1,188 @@
+# ratelimit.py - token-bucket rate limiting
+import threading
+import time
+from collections import OrderedDict
+
+try:
+    import redis
+except ImportError:
+    redis = None
+
+
+class TokenBucket:
+    # Refills `rate` tokens per second up to `capacity`; thread-safe.
+
+    def __init__(self, rate, capacity=None, clock=time.monotonic, sleep=time.sleep):
+        self.rate = float(rate)
+        self.capacity = float(capacity if capacity is not None else rate)
+        self._clock = clock
+        self._sleep = sleep
+        self._tokens = self.capacity
+        self._updated = clock()
+        self._lock = threading.Lock()
+
+    def _refill(self, now):
+        elapsed = max(now - self._updated, 0.0)
+        self._tokens = min(self.capacity, self._tokens + elapsed * self.rate)
+        self._updated = now
+
+    def try_acquire(self, tokens=1):
+        with self._lock:
+            self._refill(self._clock())
+            if self._tokens >= tokens:
+                self._tokens -= tokens
+                return True
+            return False
+
+    def refund(self, tokens=1):
+        # Give back tokens taken for a request that was then rejected elsewhere
+        with self._lock:
+            self._refill(self._clock())
+            self._tokens = min(self.capacity, self._tokens + tokens)
+
+    def acquire(self, tokens=1, timeout=None):
+        # Block until `tokens` are available; False if that would exceed `timeout` seconds
+        deadline = None if timeout is None else self._clock() + timeout
+        while True:
+            with self._lock:
+                now = self._clock()
+                self._refill(now)
+                if self._tokens >= tokens:
+                    self._tokens -= tokens
+                    return True
+                wait = (tokens - self._tokens) / self.rate
+            if deadline is not None and now + wait > deadline:
+                return False
+            self._sleep(wait)
+
+
+class MemoryBucketBackend:
+    # One TokenBucket per key, least recently used keys evicted past max_keys
+
+    def __init__(self, max_keys=10000, clock=time.monotonic):
+        self.max_keys = max_keys
+        self._clock = clock
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+
+    def try_acquire(self, key, rate, capacity):
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                bucket = self._buckets[key] = TokenBucket(rate, capacity, clock=self._clock)
+                while len(self._buckets) > self.max_keys:
+                    self._buckets.popitem(last=False)
+            else:
+                self._buckets.move_to_end(key)
+        return bucket.try_acquire()
+
+    def refund(self, key, rate, capacity):
+        with self._lock:
+            bucket = self._buckets.get(key)
+        if bucket is not None:
+            bucket.refund()
+
+    def size(self):
+        return len(self._buckets)
+
+
+_REDIS_BUCKET_SCRIPT = """
+local rate = tonumber(ARGV[1])
+local capacity = tonumber(ARGV[2])
+local t = redis.call('TIME')
+local now = tonumber(t[1]) + tonumber(t[2]) / 1000000
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local tokens = tonumber(state[1]) or capacity
+local ts = tonumber(state[2]) or now
+tokens = math.min(capacity, tokens + math.max(0, now - ts) * rate)
+local allowed = 0
+if tokens >= 1 then
+    tokens = tokens - 1
+    allowed = 1
+end
+redis.call('HSET', KEYS[1], 'tokens', tokens, 'ts', now)
+redis.call('EXPIRE', KEYS[1], math.ceil(capacity / rate) + 1)
+return allowed
+"""
+
+_REDIS_REFUND_SCRIPT = """
+local capacity = tonumber(ARGV[1])
+local tokens = tonumber(redis.call('HGET', KEYS[1], 'tokens'))
+if tokens then
+    redis.call('HSET', KEYS[1], 'tokens', math.min(capacity, tokens + 1))
+end
+return 0
+"""
+
+
+class RedisBucketBackend:
+    # Shared buckets for several instances; the refill runs atomically in a Lua script
+
+    def __init__(self, url, prefix="ratelimit:"):
+        if redis is None:
+            raise RuntimeError("redis package is not installed")
+        self.prefix = prefix
+        self._client = redis.Redis.from_url(url)
+        self._script = self._client.register_script(_REDIS_BUCKET_SCRIPT)
+        self._refund_script = self._client.register_script(_REDIS_REFUND_SCRIPT)
+
+    def try_acquire(self, key, rate, capacity):
+        return bool(self._script(keys=[self.prefix + key], args=[rate, capacity]))
+
+    def refund(self, key, rate, capacity):
+        self._refund_script(keys=[self.prefix + key], args=[capacity])
+
+    def size(self):
+        return None
+
+
+class RateLimiter:
+    # Per-key bucket (one per LINE user) plus one global bucket. Backend errors
+    # fail open: a broken shared store must not take the bot down with it.
+
+    def __init__(self, per_key_rate, per_key_burst, global_rate, global_burst, backend=None):
+        self.per_key_rate = per_key_rate
+        self.per_key_burst = per_key_burst
+        self.global_rate = global_rate
+        self.global_burst = global_burst
+        self.backend = backend or MemoryBucketBackend()
+        self._lock = threading.Lock()
+        self._counters = {"allowed": 0, "limited_key": 0, "limited_global": 0, "backend_errors": 0}
+
+    def _count(self, name):
+        with self._lock:
+            self._counters[name] += 1
+
+    def check(self, key):
+        # Returns None when allowed, otherwise "key" or "global". A key over its own
+        # limit never spends a global token, and a global denial refunds the key's token.
+        key = f"user:{key}"
+        try:
+            if not self.backend.try_acquire(key, self.per_key_rate, self.per_key_burst):
+                self._count("limited_key")
+                return "key"
+            if not self.backend.try_acquire("global", self.global_rate, self.global_burst):
+                self.backend.refund(key, self.per_key_rate, self.per_key_burst)
+                self._count("limited_global")
+                return "global"
+        except Exception:
+            self._count("backend_errors")
+        self._count("allowed")
+        return None
+
+    def stats(self):
+        with self._lock:
+            data = dict(self._counters)
+        data["tracked_keys"] = self.backend.size()
+        data["backend"] = type(self.backend).__name__
+        return data
+
+
+def rate_limit_key(event):
+    # Group/room events can come without a user_id; those share a bucket per chat,
+    # not one "None" bucket across every group
+    source = event.source
+    if getattr(source, "user_id", None):
+        return source.user_id
+    chat_id = getattr(source, "group_id", None) or getattr(source, "room_id", None)
+    return f"{source.type}:{chat_id or 'unknown'}"
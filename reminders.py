@@ -0,0 +1,110 @@
+# reminders.py - daily "you are on duty today" push fan-out
+import random
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from linebot.exceptions import LineBotApiError
+from linebot.models import TextSendMessage
+
+MULTICAST_LIMIT = 500
+RETRYABLE_STATUS = {429, 500, 502, 503, 504}
+ON_DUTY_STATUS = "ปฏิบัติงาน"
+
+DELIVERY_SENT = "sent"
+DELIVERY_FAILED = "failed"
+
+_BATCH_NAMESPACE = uuid.UUID("6f1c1f0e-5d0b-4a55-9a59-3c1f0f6d2a10")
+
+
+def plan_batches(date_str, assignments, line_ids_by_name, limit=MULTICAST_LIMIT):
+    # One multicast per duty (everyone on it gets the same text), split at the LINE limit
+    groups = {}
+    for a in assignments:
+        if a.get("status") != ON_DUTY_STATUS:
+            continue
+        line_id = line_ids_by_name.get(a.get("name"))
+        if not line_id:
+            continue
+        recipients = groups.setdefault(a.get("duty"), [])
+        if line_id not in recipients:
+            recipients.append(line_id)
+    batches = []
+    for duty, recipients in groups.items():
+        duty_key = uuid.uuid5(_BATCH_NAMESPACE, str(duty)).hex[:12]
+        for n, i in enumerate(range(0, len(recipients), limit)):
+            to = recipients[i:i + limit]
+            batch_id = f"{date_str}_{duty_key}_{n}"
+            batches.append({
+                "batch_id": batch_id,
+                "date": date_str,
+                "duty": duty,
+                "to": to,
+                "text": f"🔔 วันนี้ ({date_str}) คุณมีเวร {duty} อย่าลืมลงเวลาเข้าเวร (#เข้าเวร) ครับ",
+                # LINE de-duplicates retried requests carrying the same key
+                "retry_key": str(uuid.uuid5(_BATCH_NAMESPACE, batch_id + "|" + ",".join(sorted(to)))),
+            })
+    return batches
+
+
+class ReminderFanout:
+    # Sends planned batches with at most `max_workers` requests in flight, every
+    # attempt (including retries) gated by the shared token bucket.
+
+    def __init__(self, api, bucket, max_workers=4, max_attempts=5, base_delay=1.0, max_delay=30.0,
+                 record=None, sleep=time.sleep):
+        self.api = api
+        self.bucket = bucket
+        self.max_workers = max_workers
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.record = record
+        self._sleep = sleep
+
+    def _backoff(self, attempt, error=None):
+        retry_after = None
+        if error is not None and getattr(error, "headers", None):
+            retry_after = error.headers.get("Retry-After") or error.headers.get("retry-after")
+        try:
+            if retry_after is not None:
+                return min(float(retry_after), self.max_delay)
+        except ValueError:
+            pass
+        delay = min(self.max_delay, self.base_delay * (2 ** (attempt - 1)))
+        return delay * random.uniform(0.5, 1.0)
+
+    def _send_one(self, batch):
+        state = {"batch_id": batch["batch_id"], "recipients": len(batch["to"]), "attempts": 0,
+                 "status": DELIVERY_FAILED, "error": None}
+        for attempt in range(1, self.max_attempts + 1):
+            state["attempts"] = attempt
+            self.bucket.acquire()
+            try:
+                self.api.multicast(batch["to"], TextSendMessage(text=batch["text"]), retry_key=batch["retry_key"])
+                state["status"] = DELIVERY_SENT
+                state["error"] = None
+                break
+            except LineBotApiError as e:
+                state["error"] = f"{e.status_code}: {getattr(e.error, 'message', e)}"
+                if e.status_code == 409:
+                    # retry key already accepted by LINE: an earlier attempt went through
+                    state["status"] = DELIVERY_SENT
+                    break
+                if e.status_code not in RETRYABLE_STATUS or attempt == self.max_attempts:
+                    break
+                self._sleep(self._backoff(attempt, e))
+            except Exception as e:
+                state["error"] = str(e)
+                if attempt == self.max_attempts:
+                    break
+                self._sleep(self._backoff(attempt))
+        if self.record:
+            self.record(batch, state)
+        return state
+
+    def send(self, batches):
+        if not batches:
+            return []
+        with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+            return list(pool.map(self._send_one, batches))
@@ -0,0 +1,152 @@
+# render_service.py - Pillow rendering in a pool of worker processes
+#
+# Drawing and PNG encoding hold the GIL, so doing them on a gunicorn request thread
+# stalls every other request on the worker. Jobs here run in separate processes,
+# each of which loaded its fonts once at start-up. At most `max_pending` jobs are
+# queued or running; beyond that, and when a job exceeds its timeout, callers get
+# RenderUnavailable and reply without an image. Jobs return (original, preview)
+# PNG bytes, encoded in the worker as well.
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeout
+from concurrent.futures.process import BrokenProcessPool
+
+from image_encoding import encode_variants
+from leave_image import LeaveSummaryRenderer
+from roster_image import RosterImageRenderer
+
+# per-process renderers, created by _init_worker (or lazily for inline rendering)
+_renderers = {}
+
+
+def _init_worker(font_path):
+    leave = LeaveSummaryRenderer(font_path)
+    roster = RosterImageRenderer(font_path)
+    leave.warm()
+    roster.warm()
+    _renderers["leave"] = leave
+    _renderers["roster"] = roster
+
+
+def _ping():
+    return os.getpid()
+
+
+def _render_leave_summary(data):
+    return encode_variants(_renderers["leave"].render(data))
+
+
+def _render_roster_month(year, month, month_assignments):
+    return encode_variants(_renderers["roster"].render(year, month, month_assignments))
+
+
+class RenderUnavailable(Exception):
+    pass
+
+
+class RenderService:
+
+    def __init__(self, font_path=None, workers=2, max_pending=8, timeout=5.0):
+        # workers=0 renders inline on the calling thread (development, tests)
+        self.font_path = font_path
+        self.workers = workers
+        self.max_pending = max_pending
+        self.timeout = timeout
+        self._slots = threading.BoundedSemaphore(max_pending)
+        self._lock = threading.Lock()
+        self._pool = None
+        self._pending = 0
+        self._counters = {"completed": 0, "saturated": 0, "timeouts": 0, "errors": 0}
+
+    def _count(self, name):
+        with self._lock:
+            self._counters[name] += 1
+
+    def available(self):
+        # Snapshot: is there room in the queue right now?
+        return self.workers <= 0 or self._pending < self.max_pending
+
+    def _release(self):
+        with self._lock:
+            self._pending -= 1
+        self._slots.release()
+
+    def stats(self):
+        with self._lock:
+            data = dict(self._counters)
+        data.update(workers=self.workers, max_pending=self.max_pending, pending=self._pending)
+        return data
+
+    def _get_pool(self):
+        with self._lock:
+            if self._pool is None:
+                # spawn, not fork: the parent has request threads and open gRPC channels
+                self._pool = ProcessPoolExecutor(max_workers=self.workers,
+                                                 mp_context=multiprocessing.get_context("spawn"),
+                                                 initializer=_init_worker, initargs=(self.font_path,))
+            return self._pool
+
+    def _reset_pool(self, broken):
+        with self._lock:
+            if self._pool is broken:
+                self._pool = None
+        broken.shutdown(wait=False, cancel_futures=True)
+
+    def start(self):
+        # Pre-warm: start every worker now so the first render doesn't pay for the
+        # interpreter start-up and font loading. Never from inside a worker (spawn
+        # re-imports the parent's main module there).
+        if self._pool is not None or self.workers <= 0 or multiprocessing.parent_process() is not None:
+            return
+        pool = self._get_pool()
+        for _ in range(self.workers):
+            pool.submit(_ping)
+
+    def shutdown(self):
+        with self._lock:
+            pool, self._pool = self._pool, None
+        if pool is not None:
+            pool.shutdown(wait=False, cancel_futures=True)
+
+    def _run(self, fn, *args):
+        if self.workers <= 0:
+            if not _renderers:
+                _init_worker(self.font_path)
+            return fn(*args)
+        if not self._slots.acquire(blocking=False):
+            self._count("saturated")
+            raise RenderUnavailable("render queue full")
+        with self._lock:
+            self._pending += 1
+        pool = self._get_pool()
+        try:
+            future = pool.submit(fn, *args)
+        except BrokenProcessPool:
+            self._release()
+            self._reset_pool(pool)
+            self._count("errors")
+            raise RenderUnavailable("render pool restarted")
+        except BaseException:
+            self._release()
+            raise
+        future.add_done_callback(lambda _: self._release())
+        try:
+            result = future.result(timeout=self.timeout)
+        except FutureTimeout:
+            # a job already running can't be interrupted; it keeps its slot until done
+            future.cancel()
+            self._count("timeouts")
+            raise RenderUnavailable("render timed out")
+        except BrokenProcessPool:
+            self._reset_pool(pool)
+            self._count("errors")
+            raise RenderUnavailable("render worker died")
+        self._count("completed")
+        return result
+
+    def render_leave_summary(self, data):
+        return self._run(_render_leave_summary, data)
+
+    def render_roster_month(self, year, month, month_assignments):
+        return self._run(_render_roster_month, year, month, month_assignments)
@@ -0,0 +1,43 @@
+# request_memo.py - memoize data loaders for the lifetime of one request
+import functools
+
+from flask import g, has_app_context
+
+
+def _store():
+    # Inside a request/app context the memo lives on flask.g, so every event of a
+    # webhook delivery (handled in the same request) shares one set of fetches. CLI
+    # commands run inside an app context too; anything else is not memoized.
+    if not has_app_context():
+        return None
+    if "_request_memo" not in g:
+        g._request_memo = {}
+    return g._request_memo
+
+
+def request_memo(func):
+    name = func.__qualname__
+
+    @functools.wraps(func)
+    def wrapper(*args):
+        store = _store()
+        if store is None:
+            return func(*args)
+        key = (name, args)
+        if key not in store:
+            store[key] = func(*args)
+        return store[key]
+
+    def invalidate(*args):
+        # Drop one memoized call, or every call of this loader when no args are given
+        store = _store()
+        if not store:
+            return
+        if args:
+            store.pop((name, args), None)
+            return
+        for key in [k for k in store if k[0] == name]:
+            del store[key]
+
+    wrapper.invalidate = invalidate
+    return wrapper
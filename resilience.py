@@ -0,0 +1,198 @@
+# resilience.py - circuit breaker and a durable write-ahead log for backend outages
+import json
+import os
+import threading
+import time
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class CircuitOpenError(Exception):
+    pass
+
+
+class CircuitBreaker:
+    # Opens after `failure_threshold` consecutive failures; while open, calls are
+    # refused without touching the backend. After `reset_timeout` seconds one trial
+    # call is let through (half-open): success closes the breaker, failure re-opens it.
+
+    def __init__(self, failure_threshold=3, reset_timeout=30.0, clock=time.monotonic):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._state = CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._trial_running = False
+        self._listeners = []
+
+    def add_listener(self, fn):
+        # fn(old_state, new_state), called outside the lock
+        self._listeners.append(fn)
+
+    def _transition(self, new_state):
+        old = self._state
+        self._state = new_state
+        return (old, new_state) if old != new_state else None
+
+    def _notify(self, change):
+        if change:
+            for fn in self._listeners:
+                fn(*change)
+
+    @property
+    def state(self):
+        with self._lock:
+            if self._state == OPEN and self._clock() - self._opened_at >= self.reset_timeout:
+                return HALF_OPEN
+            return self._state
+
+    def allow(self):
+        change = None
+        with self._lock:
+            if self._state == CLOSED:
+                return True
+            if self._state == OPEN:
+                if self._clock() - self._opened_at < self.reset_timeout:
+                    return False
+                change = self._transition(HALF_OPEN)
+            if self._trial_running:
+                allowed = False
+            else:
+                self._trial_running = allowed = True
+        self._notify(change)
+        return allowed
+
+    def record_success(self):
+        with self._lock:
+            self._failures = 0
+            self._trial_running = False
+            change = self._transition(CLOSED)
+        self._notify(change)
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            self._trial_running = False
+            change = None
+            if self._state == HALF_OPEN or self._failures >= self.failure_threshold:
+                self._opened_at = self._clock()
+                change = self._transition(OPEN)
+        self._notify(change)
+
+    def call(self, fn, ok_errors=()):
+        # Run fn() through the breaker. Exceptions in ok_errors (e.g. NotFound) mean
+        # the backend answered, so they count as successes before being re-raised.
+        if not self.allow():
+            raise CircuitOpenError("circuit open")
+        try:
+            result = fn()
+        except ok_errors:
+            self.record_success()
+            raise
+        except Exception:
+            self.record_failure()
+            raise
+        self.record_success()
+        return result
+
+
+class WriteAheadLog:
+    # Append-only JSON-lines file of writes that could not reach the backend. Each
+    # append is flushed and fsync'd before returning, so an accepted write survives
+    # a restart. replay() applies entries in order and rewrites the file with
+    # whatever is left when an entry fails.
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._replay_lock = threading.Lock()
+        folder = os.path.dirname(path)
+        if folder:
+            os.makedirs(folder, exist_ok=True)
+        self._drop_torn_tail()
+        self._count = len(self._read())
+
+    def _drop_torn_tail(self):
+        # A crash mid-append can leave a final line without its newline; the next
+        # append would be glued onto it and lost with it. Terminate the line if it is
+        # a whole entry, otherwise cut it off.
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, "rb+") as f:
+            data = f.read()
+            if not data or data.endswith(b"\n"):
+                return
+            start = data.rfind(b"\n") + 1
+            try:
+                json.loads(data[start:].decode("utf-8"))
+                f.write(b"\n")
+            except ValueError:
+                f.truncate(start)
+            f.flush()
+            os.fsync(f.fileno())
+
+    def append(self, entry):
+        line = json.dumps(entry, ensure_ascii=False, default=str) + "\n"
+        with self._lock:
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(line)
+                f.flush()
+                os.fsync(f.fileno())
+            self._count += 1
+
+    def entries(self):
+        with self._lock:
+            return self._read()
+
+    def _read(self):
+        if not os.path.exists(self.path):
+            return []
+        entries = []
+        with open(self.path, encoding="utf-8") as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    entries.append(json.loads(line))
+                except ValueError:
+                    # a torn final line from a crash mid-append
+                    continue
+        return entries
+
+    def __len__(self):
+        return self._count
+
+    def replay(self, apply):
+        # apply(entry) raises to stop the replay; that entry and everything after it
+        # stay in the log. Returns (applied, remaining), or None when another replay
+        # is already running.
+        if not self._replay_lock.acquire(blocking=False):
+            return None
+        try:
+            entries = self.entries()
+            done = 0
+            for entry in entries:
+                try:
+                    apply(entry)
+                except Exception:
+                    break
+                done += 1
+            if done:
+                with self._lock:
+                    # keep entries appended while the replay was running
+                    rest = self._read()[done:]
+                    tmp = self.path + ".tmp"
+                    with open(tmp, "w", encoding="utf-8") as f:
+                        f.writelines(json.dumps(e, ensure_ascii=False, default=str) + "\n" for e in rest)
+                        f.flush()
+                        os.fsync(f.fileno())
+                    os.replace(tmp, self.path)
+                    self._count = len(rest)
+            return done, len(entries) - done
+        finally:
+            self._replay_lock.release()
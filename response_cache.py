@@ -0,0 +1,75 @@
+# response_cache.py - serialized JSON responses keyed by collection versions
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timezone
+
+
+class CachedResponse:
+    __slots__ = ("body", "etag", "last_modified", "versions", "stored_at")
+
+    def __init__(self, body, etag, last_modified, versions, stored_at):
+        self.body = body
+        self.etag = etag
+        self.last_modified = last_modified
+        self.versions = versions
+        self.stored_at = stored_at
+
+
+class ResponseCache:
+    # Each collection carries a change counter bumped on every write made through
+    # this process. An entry is valid while the counters of the collections it was
+    # built from are unchanged and it is younger than `ttl` (the TTL bounds how long
+    # writes made elsewhere, e.g. the Firestore console, can go unseen).
+
+    def __init__(self, ttl=30, max_entries=256, clock=time.monotonic):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._clock = clock
+        self._versions = {}
+        self._changed_at = {}
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def mark_changed(self, *collections):
+        now = datetime.now(timezone.utc).replace(microsecond=0)
+        with self._lock:
+            for name in collections:
+                self._versions[name] = self._versions.get(name, 0) + 1
+                self._changed_at[name] = now
+
+    def _current(self, collections):
+        return tuple(self._versions.get(name, 0) for name in collections)
+
+    def versions(self, collections):
+        # Take this before loading data so a write racing the load invalidates the entry
+        with self._lock:
+            return self._current(collections)
+
+    def get(self, key, collections):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry.versions != self._current(collections) or self._clock() - entry.stored_at >= self.ttl:
+                # left in place so put() can keep Last-Modified when the body is unchanged
+                return None
+            self._entries.move_to_end(key)
+            return entry
+
+    def put(self, key, collections, body, versions):
+        etag = hashlib.sha1(body).hexdigest()
+        with self._lock:
+            previous = self._entries.get(key)
+            if previous is not None and previous.etag == etag:
+                last_modified = previous.last_modified
+            else:
+                changed = [self._changed_at[n] for n in collections if n in self._changed_at]
+                last_modified = max(changed) if changed else datetime.now(timezone.utc).replace(microsecond=0)
+            entry = CachedResponse(body, etag, last_modified, versions, self._clock())
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+            return entry
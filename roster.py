@@ -0,0 +1,307 @@
+# roster.py - precomputed duty rotation tables for O(1) lookups by date
+import hashlib
+import json
+from array import array
+from bisect import bisect_left
+from collections import Counter, deque
+from datetime import date, datetime, timedelta
+
+REFERENCE_DATE = date(2024, 1, 1)
+# substitutes are chosen by duties done over this many trailing days
+BALANCE_WINDOW_DAYS = 90
+STATUS_ON_DUTY = "ปฏิบัติงาน"
+STATUS_ON_LEAVE = "ลา"
+LEAVE_COLOR = "#FF0000"
+
+# array('H') slot value meaning "nobody available for this duty"
+NO_PERSON = 0xFFFF
+
+
+def parse_date(value):
+    if isinstance(value, date):
+        return value
+    return datetime.strptime(value, "%Y-%m-%d").date()
+
+
+def _json_default(value):
+    return value.to_firestore() if hasattr(value, "to_firestore") else str(value)
+
+
+def inputs_version(personnel, duty_defs, leaves):
+    # Stable digest of everything the rotation depends on; used as the table key
+    payload = json.dumps([personnel, duty_defs, leaves], sort_keys=True, default=_json_default, ensure_ascii=False)
+    return hashlib.sha1(payload.encode("utf-8")).hexdigest()
+
+
+class BalancedScheduler:
+    # Base rotation: slot (day, duty) goes to person (day * num_duties + duty) % n,
+    # counted from REFERENCE_DATE over the priority-sorted personnel, so everyone
+    # gets one duty every n / num_duties days and nobody's slots move when someone
+    # else goes on leave. A slot whose person is on leave gets a substitute: the
+    # available person with the fewest duties in the trailing balance window (ties go
+    # to whoever is next in rotation order), preferring people not already on duty
+    # that day. Substitutions are made in date order, so the schedule is a pure
+    # function of its inputs, and re-solving from any day onward (with the earlier
+    # substitutions kept) gives exactly the same result as solving from scratch.
+
+    def __init__(self, num_people, num_duties, window=BALANCE_WINDOW_DAYS):
+        self.n = num_people
+        self.k = num_duties
+        self.window = window
+        self._ref = REFERENCE_DATE.toordinal()
+
+    def base_index(self, ordinal, duty_index):
+        return ((ordinal - self._ref) * self.k + duty_index) % self.n
+
+    def base_load(self, idx, first_ord, end_ord):
+        # base slots of person idx on days [first_ord, end_ord)
+        lo = (first_ord - self._ref) * self.k
+        hi = (end_ord - self._ref) * self.k
+        return (hi - 1 - idx) // self.n - (lo - 1 - idx) // self.n
+
+    def solve(self, off_by_day, from_ord=None, prior=None):
+        # off_by_day: ordinal -> set of person indexes on leave. Returns
+        # {(ordinal, duty_index): person index or NO_PERSON} for every slot whose base
+        # person is on leave. With from_ord, substitutions before that day are taken
+        # from prior (a previous solve over the same leaves up to from_ord).
+        subs = {}
+        delta = Counter()
+        recent = deque()  # (ordinal, gained, lost) inside the balance window
+        if from_ord is not None and prior:
+            for key, idx in sorted(prior.items()):
+                ordinal = key[0]
+                if ordinal >= from_ord:
+                    break
+                subs[key] = idx
+                if ordinal >= from_ord - self.window and idx != NO_PERSON:
+                    lost = self.base_index(*key)
+                    recent.append((ordinal, idx, lost))
+                    delta[idx] += 1
+                    delta[lost] -= 1
+        if not self.n or not self.k:
+            return subs
+        start = from_ord if from_ord is not None else min(off_by_day, default=0)
+        for ordinal in sorted(o for o in off_by_day if o >= start):
+            off = off_by_day[ordinal]
+            while recent and recent[0][0] < ordinal - self.window:
+                _, gained, lost = recent.popleft()
+                delta[gained] -= 1
+                delta[lost] += 1
+            bases = [self.base_index(ordinal, i) for i in range(self.k)]
+            on_duty = {b for b in bases if b not in off}
+            for i, b in enumerate(bases):
+                if b not in off:
+                    continue
+                pick = self._substitute(ordinal, b, off, on_duty, delta)
+                subs[(ordinal, i)] = pick
+                if pick == NO_PERSON:
+                    continue
+                on_duty.add(pick)
+                recent.append((ordinal, pick, b))
+                delta[pick] += 1
+                delta[b] -= 1
+        return subs
+
+    def _substitute(self, ordinal, absent, off, on_duty, delta):
+        best, best_key = NO_PERSON, None
+        first = ordinal - self.window
+        for fallback in (False, True):
+            # second pass only when everyone available is already on duty today
+            for idx in range(self.n):
+                if idx in off or (idx in on_duty) != fallback:
+                    continue
+                key = (self.base_load(idx, first, ordinal) + delta[idx], (idx - absent) % self.n)
+                if best_key is None or key < best_key:
+                    best, best_key = idx, key
+            if best_key is not None:
+                break
+        return best
+
+
+class RotationTable:
+    # Assignments for [start, start + days) are stored as personnel indexes in a flat
+    # array('H') of days * num_duties slots. Dates outside the horizon are computed on
+    # demand from the same inputs, so callers never need to go back to Firestore.
+    # Inputs are models.Personnel / Duty / Leave records. Pass the previous table as
+    # `previous` when only leaves changed: its substitutions before the first changed
+    # leave day are kept and only the rest is re-solved.
+
+    def __init__(self, personnel, duty_defs, leaves, start, days, version=None, previous=None):
+        self.version = version or inputs_version(personnel, duty_defs, leaves)
+        self.structure = inputs_version(personnel, duty_defs, [])
+        # the records this table was built from, for what-if overlays (read-only)
+        self.source = (personnel, duty_defs, leaves)
+        # sorted() is stable, so ties keep Firestore stream order like the old per-call sort
+        self.personnel = sorted(personnel, key=lambda p: p.sort_priority)
+        self.names = [p.name for p in self.personnel]
+        self.duties = [(d.duty_name or "Duty N/A", d.color or "#000000") for d in duty_defs]
+        if len(self.personnel) >= NO_PERSON:
+            raise ValueError("too many personnel for a compact rotation table")
+
+        self.leaves = [(leave.start_ord, leave.end_ord, leave.personnel_name, leave.leave_type)
+                       for leave in leaves
+                       if leave.has_valid_dates and leave.personnel_name is not None and leave.leave_type is not None]
+
+        self.start = parse_date(start)
+        self.start_ord = self.start.toordinal()
+        self.days = days
+        self.scheduler = BalancedScheduler(len(self.personnel), len(self.duties))
+        self._solve(previous)
+        self._build()
+
+    def _solve(self, previous):
+        indexes = {}
+        for idx, name in enumerate(self.names):
+            indexes.setdefault(name, []).append(idx)
+        off_by_day = {}
+        for start_ord, stop_ord, name, _ in self.leaves:
+            for ordinal in range(start_ord, stop_ord + 1):
+                off_by_day.setdefault(ordinal, set()).update(indexes.get(name, ()))
+        from_ord, prior = None, None
+        if previous is not None and previous.structure == self.structure:
+            changed = set(previous.leaves) ^ set(self.leaves)
+            from_ord = min((leave[0] for leave in changed), default=None)
+            if from_ord is None:
+                self._subs = previous._subs
+                return
+            prior = previous._subs
+        self._subs = self.scheduler.solve(off_by_day, from_ord, prior)
+
+    def _build(self):
+        num_duties = len(self.duties)
+        end_ord = self.start_ord + self.days - 1
+
+        # day offset -> [(name, leave_type), ...] in stream order
+        self._leave_days = {}
+        for start_ord, stop_ord, name, leave_type in self.leaves:
+            for ordinal in range(max(start_ord, self.start_ord), min(stop_ord, end_ord) + 1):
+                self._leave_days.setdefault(ordinal - self.start_ord, []).append((name, leave_type))
+
+        self._slots = array("H", [NO_PERSON]) * (self.days * num_duties)
+        person_slots = [[] for _ in self.personnel]
+        if num_duties and self.personnel:
+            for offset in range(self.days):
+                base = offset * num_duties
+                for i in range(num_duties):
+                    idx = self._index_at(i, self.start_ord + offset, materialized=False)
+                    if idx is None:
+                        continue
+                    self._slots[base + i] = idx
+                    person_slots[idx].append(base + i)
+        # per person: sorted slot numbers (day * num_duties + duty) for bisect lookups
+        self._person_slots = [array("I", s) for s in person_slots]
+        self._name_index = {}
+        for idx, name in enumerate(self.names):
+            self._name_index.setdefault(name, []).append(idx)
+
+    def _available(self, leave_map):
+        return [idx for idx, name in enumerate(self.names) if name not in leave_map]
+
+    def _leave_map(self, ordinal):
+        offset = ordinal - self.start_ord
+        if 0 <= offset < self.days:
+            return dict(self._leave_days.get(offset, ()))
+        return {name: leave_type for start_ord, stop_ord, name, leave_type in self.leaves
+                if start_ord <= ordinal <= stop_ord}
+
+    def covers(self, day):
+        return 0 <= parse_date(day).toordinal() - self.start_ord < self.days
+
+    def person_index_on(self, duty_index, day):
+        return self._index_at(duty_index, parse_date(day).toordinal())
+
+    def _index_at(self, duty_index, ordinal, materialized=True):
+        offset = ordinal - self.start_ord
+        num_duties = len(self.duties)
+        if not 0 <= duty_index < num_duties or not self.personnel:
+            return None
+        if materialized and 0 <= offset < self.days:
+            idx = self._slots[offset * num_duties + duty_index]
+        else:
+            idx = self._subs.get((ordinal, duty_index))
+            if idx is None:
+                idx = self.scheduler.base_index(ordinal, duty_index)
+        return None if idx == NO_PERSON else idx
+
+    def who_is_on(self, duty_index, day):
+        idx = self.person_index_on(duty_index, day)
+        return None if idx is None else self.names[idx]
+
+    def next_duty(self, name, from_day):
+        # First (date, duty_name) on or after from_day within the horizon, or None
+        num_duties = len(self.duties)
+        offset = max(parse_date(from_day).toordinal() - self.start_ord, 0)
+        best = None
+        for idx in self._name_index.get(name, ()):
+            slots = self._person_slots[idx]
+            pos = bisect_left(slots, offset * num_duties)
+            if pos < len(slots) and (best is None or slots[pos] < best):
+                best = slots[pos]
+        if best is None:
+            return None
+        day_offset, duty_index = divmod(best, num_duties)
+        return self.start + timedelta(days=day_offset), self.duties[duty_index][0]
+
+    def upcoming(self, name, from_day, days):
+        # [(date, duty_name), ...] for name over [from_day, from_day + days) in one pass:
+        # a bisect into the person's slot arrays, then a per-day fallback past the horizon
+        num_duties = len(self.duties)
+        first = parse_date(from_day).toordinal()
+        last = first + days
+        indexes = self._name_index.get(name, ())
+        if not num_duties or not indexes:
+            return []
+        hits = []
+        lo = max(first - self.start_ord, 0) * num_duties
+        hi = max(min(last - self.start_ord, self.days), 0) * num_duties
+        for idx in indexes:
+            slots = self._person_slots[idx]
+            for pos in range(bisect_left(slots, lo), bisect_left(slots, hi)):
+                hits.append(slots[pos])
+        hits.sort()
+        result = [(self.start + timedelta(days=slot // num_duties), self.duties[slot % num_duties][0])
+                  for slot in hits]
+        wanted = set(indexes)
+        for ordinal in range(max(first, self.start_ord + self.days), last):
+            for i in range(num_duties):
+                if self._index_at(i, ordinal) in wanted:
+                    result.append((date.fromordinal(ordinal), self.duties[i][0]))
+        for ordinal in range(first, min(last, self.start_ord)):
+            for i in range(num_duties):
+                if self._index_at(i, ordinal) in wanted:
+                    result.append((date.fromordinal(ordinal), self.duties[i][0]))
+        result.sort(key=lambda item: item[0])
+        return result
+
+    def find_personnel(self, **fields):
+        for person in self.personnel:
+            if all(getattr(person, k) == v for k, v in fields.items()):
+                return person
+        return None
+
+    def assignments_for(self, day):
+        # Same shape and ordering as the original get_duty_by_date output
+        ordinal = parse_date(day).toordinal()
+        if not self.personnel:
+            return []
+        leave_map = self._leave_map(ordinal)
+        leave_rows = [{
+            "duty": f"ลา ({leave_type})",
+            "name": name,
+            "color": LEAVE_COLOR,
+            "status": STATUS_ON_LEAVE
+        } for name, leave_type in leave_map.items()]
+        if not self._available(leave_map):
+            return leave_rows
+        if not self.duties:
+            return []
+        rows = []
+        for i, (duty_name, color) in enumerate(self.duties):
+            idx = self._index_at(i, ordinal)
+            rows.append({
+                "duty": duty_name,
+                "name": self.personnel[idx].name or "Name N/A",
+                "color": color,
+                "status": STATUS_ON_DUTY
+            })
+        return rows + leave_rows
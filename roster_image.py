@@ -0,0 +1,143 @@
+# roster_image.py - monthly roster calendar image (#ตารางเวร)
+import calendar
+import threading
+from datetime import date
+
+try:
+    from PIL import Image, ImageDraw, ImageFont
+except Exception:
+    Image = ImageDraw = ImageFont = None
+
+from text_layout import TextMeasurer
+
+THAI_MONTHS = ["", "มกราคม", "กุมภาพันธ์", "มีนาคม", "เมษายน", "พฤษภาคม", "มิถุนายน",
+               "กรกฎาคม", "สิงหาคม", "กันยายน", "ตุลาคม", "พฤศจิกายน", "ธันวาคม"]
+THAI_WEEKDAYS = ["จันทร์", "อังคาร", "พุธ", "พฤหัสบดี", "ศุกร์", "เสาร์", "อาทิตย์"]
+
+CELL_WIDTH = 200
+CELL_PADDING = 8
+DAY_LABEL_HEIGHT = 26
+LINE_HEIGHT = 22
+TITLE_HEIGHT = 70
+WEEKDAY_HEIGHT = 36
+MARGIN = 20
+BACKGROUND = "#F0F4F8"
+GRID_COLOR = "#B0BEC5"
+ON_DUTY_STATUS = "ปฏิบัติงาน"
+
+
+def materialize_month(table, year, month):
+    # [(date, assignments), ...] for every day of the month, read from the rotation table
+    days_in_month = calendar.monthrange(year, month)[1]
+    return [(d, table.assignments_for(d)) for d in (date(year, month, n) for n in range(1, days_in_month + 1))]
+
+
+class RosterImageRenderer:
+    # The grid, title and weekday headers depend only on (year, month, cell height),
+    # so they are drawn once into a cached template; each render copies the template
+    # and fills in the day cells.
+
+    def __init__(self, font_path=None, max_templates=24):
+        self.font_path = font_path
+        self.max_templates = max_templates
+        self._fonts = {}
+        self._measurers = {}
+        self._templates = {}
+        self._lock = threading.Lock()
+
+    def font(self, size):
+        if size not in self._fonts:
+            loaded = None
+            if self.font_path:
+                try:
+                    loaded = ImageFont.truetype(self.font_path, size)
+                except Exception:
+                    loaded = None
+            self._fonts[size] = loaded or ImageFont.load_default()
+        return self._fonts[size]
+
+    def measurer(self, size):
+        if size not in self._measurers:
+            self._measurers[size] = TextMeasurer(self.font(size))
+        return self._measurers[size]
+
+    def warm(self):
+        for size in (34, 18, 15):
+            self.font(size)
+
+    def _layout(self, year, month, lines_per_cell):
+        weeks = calendar.Calendar(firstweekday=0).monthdatescalendar(year, month)
+        cell_height = DAY_LABEL_HEIGHT + lines_per_cell * LINE_HEIGHT + CELL_PADDING
+        width = MARGIN * 2 + CELL_WIDTH * 7
+        height = MARGIN * 2 + TITLE_HEIGHT + WEEKDAY_HEIGHT + cell_height * len(weeks)
+        return weeks, cell_height, width, height
+
+    def _template(self, year, month, lines_per_cell):
+        key = (year, month, lines_per_cell)
+        with self._lock:
+            cached = self._templates.get(key)
+        if cached is not None:
+            return cached
+        weeks, cell_height, width, height = self._layout(year, month, lines_per_cell)
+        img = Image.new("RGB", (width, height), color=BACKGROUND)
+        d = ImageDraw.Draw(img)
+        title = f"ตารางเวร {THAI_MONTHS[month]} {year + 543}"
+        d.text((width / 2, MARGIN + 12), title, fill=(25, 25, 112), font=self.font(34), anchor="mt")
+        top = MARGIN + TITLE_HEIGHT
+        header_font = self.font(18)
+        for col, label in enumerate(THAI_WEEKDAYS):
+            x = MARGIN + col * CELL_WIDTH
+            d.rectangle((x, top, x + CELL_WIDTH, top + WEEKDAY_HEIGHT), fill="#007BFF", outline=GRID_COLOR)
+            d.text((x + CELL_WIDTH / 2, top + WEEKDAY_HEIGHT / 2), label, fill="#FFFFFF", font=header_font, anchor="mm")
+        top += WEEKDAY_HEIGHT
+        for row, week in enumerate(weeks):
+            for col, day in enumerate(week):
+                x = MARGIN + col * CELL_WIDTH
+                y = top + row * cell_height
+                fill = "#FFFFFF" if day.month == month else "#E3E8ED"
+                d.rectangle((x, y, x + CELL_WIDTH, y + cell_height), fill=fill, outline=GRID_COLOR)
+        with self._lock:
+            if len(self._templates) >= self.max_templates:
+                self._templates.pop(next(iter(self._templates)))
+            self._templates[key] = img
+        return img
+
+    def render(self, year, month, month_assignments):
+        # month_assignments: output of materialize_month()
+        lines_per_cell = 1
+        for _, assignments in month_assignments:
+            on_duty = sum(1 for a in assignments if a.get("status") == ON_DUTY_STATUS)
+            on_leave = len(assignments) - on_duty
+            lines_per_cell = max(lines_per_cell, on_duty + (1 if on_leave else 0))
+        weeks, cell_height, _, _ = self._layout(year, month, lines_per_cell)
+        img = self._template(year, month, lines_per_cell).copy()
+        d = ImageDraw.Draw(img)
+        day_font = self.font(18)
+        body_font = self.font(15)
+        body_measure = self.measurer(15)
+        by_day = dict(month_assignments)
+        top = MARGIN + TITLE_HEIGHT + WEEKDAY_HEIGHT
+        text_width = CELL_WIDTH - CELL_PADDING * 2
+        for row, week in enumerate(weeks):
+            for col, day in enumerate(week):
+                if day.month != month:
+                    continue
+                x = MARGIN + col * CELL_WIDTH + CELL_PADDING
+                y = top + row * cell_height + 4
+                d.text((x, y), str(day.day), fill=(25, 25, 112), font=day_font)
+                y += DAY_LABEL_HEIGHT
+                assignments = by_day.get(day, [])
+                leaves = 0
+                for a in assignments:
+                    if a.get("status") != ON_DUTY_STATUS:
+                        leaves += 1
+                        continue
+                    line = body_measure.fit(f"{a.get('duty')}: {a.get('name')}", text_width)
+                    try:
+                        d.text((x, y), line, fill=a.get("color") or "#000000", font=body_font)
+                    except ValueError:
+                        d.text((x, y), line, fill="#000000", font=body_font)
+                    y += LINE_HEIGHT
+                if leaves:
+                    d.text((x, y), f"ลา {leaves} คน", fill="#FF0000", font=body_font)
+        return img
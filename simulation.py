@@ -0,0 +1,130 @@
+# simulation.py - what-if rosters over the cached inputs, without writing anything
+#
+# RosterOverlay wraps the personnel / duty / leave records the live rotation table
+# was built from. Each list is shared with the base until a change touches it, and
+# only then copied, so a simulation that adds two leaves copies the leave list and
+# nothing else. The overlay's inputs feed a new RotationTable built with the live
+# table as `previous`; when personnel and duties are unchanged that only re-solves
+# from the first changed leave day.
+from collections import Counter
+from datetime import date, timedelta
+
+from models import Personnel, Duty, Leave
+from roster import STATUS_ON_DUTY
+
+
+class RosterOverlay:
+
+    def __init__(self, personnel, duty_defs, leaves):
+        self._base = {"personnel": personnel, "duties": duty_defs, "leaves": leaves}
+        self._own = {}
+
+    def _writable(self, name):
+        if name not in self._own:
+            self._own[name] = list(self._base[name])
+        return self._own[name]
+
+    def _current(self, name):
+        return self._own.get(name, self._base[name])
+
+    @property
+    def changed(self):
+        return sorted(self._own)
+
+    def inputs(self):
+        return self._current("personnel"), self._current("duties"), self._current("leaves")
+
+    def add_leave(self, data):
+        leave = Leave.from_dict(data, data.get("doc_id"))
+        if not leave.has_valid_dates or not leave.personnel_name:
+            raise ValueError("leave needs personnel_name, start_date and end_date (YYYY-MM-DD)")
+        self._writable("leaves").append(leave)
+
+    def remove_leave(self, doc_id):
+        leaves = self._current("leaves")
+        kept = [leave for leave in leaves if leave.doc_id != doc_id]
+        if len(kept) != len(leaves):
+            self._own["leaves"] = kept
+
+    def add_personnel(self, data):
+        if not data.get("name"):
+            raise ValueError("personnel needs a name")
+        self._writable("personnel").append(Personnel.from_dict(data, data.get("doc_id")))
+
+    def remove_personnel(self, name):
+        people = self._current("personnel")
+        kept = [p for p in people if p.name != name]
+        if len(kept) != len(people):
+            self._own["personnel"] = kept
+
+    def add_duty(self, data):
+        if not data.get("duty_name"):
+            raise ValueError("duty needs a duty_name")
+        duties = self._writable("duties")
+        duties.append(Duty.from_dict(data, data.get("doc_id")))
+        # same order as the priority-ordered Firestore query; stable for ties
+        duties.sort(key=lambda d: (d.priority is None, d.priority if d.priority is not None else 0))
+
+    def remove_duty(self, duty_name):
+        duties = self._current("duties")
+        kept = [d for d in duties if d.duty_name != duty_name]
+        if len(kept) != len(duties):
+            self._own["duties"] = kept
+
+
+def _duty_keys(table):
+    # One stable key per duty column, in table order: the duty's doc_id, or its name
+    # plus occurrence for duties without one, so same-named duties stay apart
+    seen = Counter()
+    keys = []
+    for duty in table.source[1]:
+        name = duty.duty_name or "Duty N/A"
+        seen[name] += 1
+        keys.append(duty.doc_id or (name, seen[name]))
+    return keys
+
+
+def _rows_by_slot(rows, duty_keys):
+    # slot key -> (duty, person). On-duty rows come one per duty in table order, so
+    # they take the duty keys; "ลา (type)" rows are keyed per person
+    slots = {}
+    on_duty = [row for row in rows if row.get("status") == STATUS_ON_DUTY]
+    for key, row in zip(duty_keys, on_duty):
+        slots[("duty", key)] = (row["duty"], row["name"])
+    for row in rows:
+        if row.get("status") != STATUS_ON_DUTY:
+            slots[("leave", row["duty"], row["name"])] = (row["duty"], row["name"])
+    return slots
+
+
+def diff_assignments(before, after, first, last):
+    # [{"date", "duty", "before", "after"}] for every slot that differs on [first, last]
+    changes = []
+    before_keys, after_keys = _duty_keys(before), _duty_keys(after)
+    day = first
+    while day <= last:
+        old = _rows_by_slot(before.assignments_for(day), before_keys)
+        new = _rows_by_slot(after.assignments_for(day), after_keys)
+        for key in sorted(old.keys() | new.keys(), key=str):
+            old_duty, old_name = old.get(key, (None, None))
+            new_duty, new_name = new.get(key, (None, None))
+            if old_name != new_name:
+                changes.append({
+                    "date": day.isoformat(),
+                    "duty": new_duty or old_duty,
+                    "before": old_name,
+                    "after": new_name
+                })
+        day += timedelta(days=1)
+    return changes
+
+
+def parse_range(first, last, default_days, max_days):
+    # (first date, last date) from YYYY-MM-DD strings, defaulting to today onward
+    first = date.fromisoformat(first) if first else date.today()
+    last = date.fromisoformat(last) if last else first + timedelta(days=default_days - 1)
+    if last < first:
+        raise ValueError("to must not be before from")
+    if (last - first).days + 1 > max_days:
+        raise ValueError(f"range is limited to {max_days} days")
+    return first, last
@@ -0,0 +1,107 @@
+# staffing.py - minimum-staffing checks over leave date ranges
+#
+# Every duty needs a different person, so a day is short-staffed when fewer people
+# are off leave than there are duties; the rotation would otherwise give someone
+# two duties that day. Leaves are kept as a sorted list of start/end events, and a
+# query over [first, last] sweeps only the events inside that range: O(n) to set up
+# who is already on leave at `first`, then O(m log n) for the m events in range.
+from bisect import bisect_left, insort
+from collections import Counter
+from datetime import date
+from heapq import merge
+
+START = 1
+END = -1
+
+
+def _events(start_ord, end_ord, name):
+    # a leave ending on day e frees the person from day e + 1
+    return [(start_ord, START, name), (end_ord + 1, END, name)]
+
+
+class StaffingValidator:
+
+    def __init__(self, personnel_names, required, leaves=()):
+        # personnel_names: one entry per person (the rotation takes everyone with a
+        # name off duty when that name is on leave); required: people needed per day,
+        # i.e. the number of duties; leaves: (start_ord, end_ord, name)
+        self.headcount = Counter(personnel_names)
+        self.total = len(personnel_names)
+        self.required = required
+        self._leaves = []
+        self._events = []
+        for start_ord, end_ord, name in leaves:
+            self.add(start_ord, end_ord, name, _sort=False)
+        self._events.sort()
+
+    def add(self, start_ord, end_ord, name, _sort=True):
+        # Count another approved leave (e.g. after approving one of a batch)
+        if name not in self.headcount or end_ord < start_ord:
+            return
+        self._leaves.append((start_ord, end_ord, name))
+        for event in _events(start_ord, end_ord, name):
+            if _sort:
+                insort(self._events, event)
+            else:
+                self._events.append(event)
+
+    def _sweep(self, first, last, extra=()):
+        # Yields (seg_first, seg_last, available, on_leave) for consecutive runs of
+        # days in [first, last]; on_leave maps name -> overlapping leaves and is
+        # only valid until the next item is requested.
+        on_leave = Counter()
+        unavailable = 0
+        extra_events = []
+        # state just before the events on `first` (those are applied by the loop below)
+        for start_ord, end_ord, name in [*self._leaves, *extra]:
+            if start_ord < first <= end_ord + 1 and name in self.headcount:
+                if on_leave[name] == 0:
+                    unavailable += self.headcount[name]
+                on_leave[name] += 1
+        for start_ord, end_ord, name in extra:
+            if name in self.headcount and end_ord >= start_ord:
+                extra_events.extend(_events(start_ord, end_ord, name))
+        extra_events.sort()
+        pos = bisect_left(self._events, (first,))
+        events = merge(self._events[pos:], (e for e in extra_events if e[0] >= first))
+        cursor = first
+        for ordinal, kind, name in events:
+            if ordinal > last:
+                break
+            if ordinal > cursor:
+                yield cursor, ordinal - 1, self.total - unavailable, on_leave
+                cursor = ordinal
+            if kind == START:
+                if on_leave[name] == 0:
+                    unavailable += self.headcount[name]
+                on_leave[name] += 1
+            else:
+                on_leave[name] -= 1
+                if on_leave[name] == 0:
+                    unavailable -= self.headcount[name]
+                    del on_leave[name]
+        if cursor <= last:
+            yield cursor, last, self.total - unavailable, on_leave
+
+    def _shortfall(self, seg_first, seg_last, available, on_leave):
+        return {
+            "start": date.fromordinal(seg_first).isoformat(),
+            "end": date.fromordinal(seg_last).isoformat(),
+            "available": available,
+            "required": self.required,
+            "on_leave": sorted(on_leave)
+        }
+
+    def shortfalls(self, first, last):
+        # Runs of days in [first, last] with fewer people available than required
+        return [self._shortfall(*segment) for segment in self._sweep(first, last)
+                if segment[2] < self.required]
+
+    def conflicts(self, start_ord, end_ord, name):
+        # Days on which a new leave for `name` would leave (or keep) the roster short:
+        # days where name would otherwise be working and staffing ends up below required
+        if name not in self.headcount:
+            return []
+        return [self._shortfall(*segment)
+                for segment in self._sweep(start_ord, end_ord, extra=[(start_ord, end_ord, name)])
+                if segment[2] < self.required and segment[3][name] == 1]
@@ -0,0 +1,154 @@
+# Counter arithmetic behind LeaveStats: a leave's contribution per (person, year) and
+# the deltas applied to the stats documents when a leave is created, updated or deleted
+import random
+from datetime import date, timedelta
+
+import pytest
+
+from leave_stats import add_deltas, apply_deltas, days_taken, leave_contributions, _drop_noops
+from models import Leave
+
+TRIALS = 200
+SICK = "ลาป่วย"
+VACATION = "ลาพัก"
+
+
+def _leave(start, end, name="p0", leave_type=SICK, status="Pending"):
+    return {"personnel_name": name, "leave_type": leave_type, "start_date": start,
+            "end_date": end, "status": status}
+
+
+def _write(docs, old, new):
+    # What LeaveStats._run does for one leave, on plain dicts keyed by (name, year)
+    deltas = {}
+    add_deltas(deltas, old, -1)
+    add_deltas(deltas, new, 1)
+    deltas = _drop_noops(deltas)
+    for (name, year), cells in deltas.items():
+        docs[(name, year)] = apply_deltas(docs.get((name, year)), name, year, cells)
+    return deltas
+
+
+def _counters(docs):
+    # by_type without the server timestamp, empty documents dropped
+    return {key: doc["by_type"] for key, doc in docs.items() if doc["by_type"]}
+
+
+def _recount(leaves):
+    docs = {}
+    for data in leaves:
+        _write(docs, None, data)
+    return _counters(docs)
+
+
+def test_single_year_leave():
+    contributions = leave_contributions(Leave.from_dict(_leave("2025-03-01", "2025-03-03")))
+    assert contributions == {("p0", 2025): (1, 3)}
+
+
+def test_leave_spanning_new_year_splits_days_and_counts_once():
+    contributions = leave_contributions(Leave.from_dict(_leave("2024-12-30", "2025-01-02")))
+    assert contributions == {("p0", 2024): (1, 2), ("p0", 2025): (0, 2)}
+
+    docs = {}
+    _write(docs, None, _leave("2024-12-30", "2025-01-02", status="Approved"))
+    assert days_taken(docs[("p0", 2024)], SICK, "Approved") == 2
+    assert days_taken(docs[("p0", 2025)], SICK, "Approved") == 2
+    assert docs[("p0", 2024)]["by_type"][SICK]["Approved"]["count"] == 1
+    assert docs[("p0", 2025)]["by_type"][SICK]["Approved"]["count"] == 0
+
+
+@pytest.mark.parametrize("data", [
+    None,
+    _leave("2025-03-05", "2025-03-01"),
+    _leave("2025-03-01", "not a date"),
+    _leave("2025-03-01", "2025-03-02", name=""),
+    _leave("2025-03-01", "2025-03-02", leave_type=""),
+])
+def test_invalid_leaves_contribute_nothing(data):
+    assert add_deltas({}, data, 1) == {}
+
+
+def test_missing_status_counts_as_pending():
+    data = _leave("2025-03-01", "2025-03-01")
+    del data["status"]
+    docs = {}
+    _write(docs, None, data)
+    assert days_taken(docs[("p0", 2025)], SICK, "Pending") == 1
+
+
+def test_status_change_moves_days_between_cells():
+    pending = _leave("2025-05-01", "2025-05-04")
+    approved = {**pending, "status": "Approved"}
+    docs = {}
+    _write(docs, None, pending)
+    _write(docs, pending, approved)
+    assert _counters(docs) == {("p0", 2025): {SICK: {"Approved": {"count": 1, "days": 4}}}}
+
+    rejected = {**approved, "status": "Rejected"}
+    _write(docs, approved, rejected)
+    assert days_taken(docs[("p0", 2025)], SICK, "Approved") == 0
+    assert _counters(docs) == {("p0", 2025): {SICK: {"Rejected": {"count": 1, "days": 4}}}}
+
+
+def test_status_change_across_new_year_touches_both_documents():
+    pending = _leave("2025-12-31", "2026-01-01")
+    approved = {**pending, "status": "Approved"}
+    docs = {}
+    _write(docs, None, pending)
+    deltas = _write(docs, pending, approved)
+    assert set(deltas) == {("p0", 2025), ("p0", 2026)}
+    assert _counters(docs) == _recount([approved])
+
+
+def test_delete_removes_empty_cells():
+    first = _leave("2025-02-01", "2025-02-02", status="Approved")
+    second = _leave("2025-06-01", "2025-06-01", leave_type=VACATION, status="Approved")
+    docs = {}
+    _write(docs, None, first)
+    _write(docs, None, second)
+    _write(docs, first, None)
+    assert _counters(docs) == {("p0", 2025): {VACATION: {"Approved": {"count": 1, "days": 1}}}}
+    _write(docs, second, None)
+    assert _counters(docs) == {}
+
+
+def test_noop_update_writes_no_counters():
+    old = _leave("2025-07-01", "2025-07-10", status="Approved")
+    new = {**old, "reason": "updated reason"}
+    assert _write({}, old, new) == {}
+    # moving a leave within the year keeps the count but changes the days
+    moved = {**old, "end_date": "2025-07-12"}
+    assert _write({}, old, moved) == {("p0", 2025): {(SICK, "Approved"): [0, 2]}}
+
+
+def _random_leave(rng):
+    first = date(2024, 12, 1) + timedelta(days=rng.randrange(90))
+    return _leave(first.isoformat(), (first + timedelta(days=rng.randrange(40))).isoformat(),
+                  name=rng.choice(["p0", "p1"]), leave_type=rng.choice([SICK, VACATION]),
+                  status=rng.choice(["Pending", "Approved", "Rejected"]))
+
+
+@pytest.mark.parametrize("seed", range(TRIALS))
+def test_incremental_counters_match_recount(seed):
+    rng = random.Random(seed)
+    leaves = {}
+    docs = {}
+    for _ in range(rng.randint(1, 30)):
+        op = rng.random()
+        lid = rng.randrange(6)
+        old = leaves.get(lid)
+        if op < 0.4 or old is None:
+            new = _random_leave(rng)
+        elif op < 0.7:
+            new = {**old, "status": rng.choice(["Pending", "Approved", "Rejected"])}
+        elif op < 0.8:
+            new = dict(old)
+        else:
+            new = None
+        _write(docs, old, new)
+        if new is None:
+            leaves.pop(lid, None)
+        else:
+            leaves[lid] = new
+    assert _counters(docs) == _recount(leaves.values())
@@ -0,0 +1,109 @@
+# RateLimiter on the in-memory backend with a hand-driven clock, and the bucket key
+# derived from LINE webhook events.
+import pytest
+from linebot.models import MessageEvent, SourceGroup, SourceRoom, SourceUser
+
+from ratelimit import MemoryBucketBackend, RateLimiter, TokenBucket, rate_limit_key
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock():
+    return Clock()
+
+
+def _limiter(clock, per_key=(1, 2), global_=(10, 3), max_keys=100):
+    backend = MemoryBucketBackend(max_keys=max_keys, clock=clock)
+    return RateLimiter(per_key[0], per_key[1], global_[0], global_[1], backend=backend)
+
+
+def test_per_key_burst_then_refill(clock):
+    limiter = _limiter(clock, global_=(100, 100))
+    assert [limiter.check("U1") for _ in range(3)] == [None, None, "key"]
+    # another user has their own bucket
+    assert limiter.check("U2") is None
+    clock.now += 0.5
+    assert limiter.check("U1") == "key"
+    clock.now += 0.5
+    assert limiter.check("U1") is None
+    assert limiter.stats()["limited_key"] == 2
+
+
+def test_key_denial_spends_no_global_token(clock):
+    limiter = _limiter(clock, per_key=(1, 1), global_=(1, 2))
+    assert limiter.check("U1") is None
+    for _ in range(5):
+        assert limiter.check("U1") == "key"
+    # one global token left for someone else
+    assert limiter.check("U2") is None
+    assert limiter.check("U3") == "global"
+
+
+def test_global_denial_refunds_key_token(clock):
+    limiter = _limiter(clock, per_key=(1, 1), global_=(1, 1))
+    assert limiter.check("U1") is None
+    assert limiter.check("U2") == "global"
+    # U2's own token was given back: once the global bucket refills U2 gets through
+    # even though no time has passed for a per-key refill to matter
+    clock.now += 1
+    assert limiter.check("U2") is None
+    stats = limiter.stats()
+    assert stats["limited_global"] == 1
+    assert stats["allowed"] == 2
+
+
+def test_refund_never_exceeds_capacity(clock):
+    bucket = TokenBucket(1, 2, clock=clock)
+    bucket.refund()
+    assert [bucket.try_acquire() for _ in range(3)] == [True, True, False]
+    bucket.refund()
+    bucket.refund()
+    bucket.refund()
+    assert [bucket.try_acquire() for _ in range(3)] == [True, True, False]
+
+
+def test_memory_backend_evicts_least_recent(clock):
+    # the global bucket lives in the same backend, so room for three users
+    limiter = _limiter(clock, per_key=(1, 1), global_=(100, 100), max_keys=4)
+    for key in ("U1", "U2", "U3"):
+        assert limiter.check(key) is None
+    # touch U1 so U2 is the oldest when U4 arrives
+    assert limiter.check("U1") == "key"
+    assert limiter.check("U4") is None
+    assert limiter.stats()["tracked_keys"] == 4
+    # U2 lost its bucket and starts from a full one; U1 is still empty
+    assert limiter.check("U2") is None
+    assert limiter.check("U1") == "key"
+
+
+def test_backend_error_fails_open():
+    class Broken:
+        def try_acquire(self, key, rate, capacity):
+            raise ConnectionError("store down")
+
+        def size(self):
+            return None
+
+    limiter = RateLimiter(1, 1, 1, 1, backend=Broken())
+    assert [limiter.check("U1") for _ in range(3)] == [None, None, None]
+    assert limiter.stats()["backend_errors"] == 3
+
+
+def test_rate_limit_key_prefers_user_id():
+    assert rate_limit_key(MessageEvent(source=SourceUser(user_id="U1"))) == "U1"
+    assert rate_limit_key(MessageEvent(source=SourceGroup(group_id="G1", user_id="U1"))) == "U1"
+    assert rate_limit_key(MessageEvent(source=SourceRoom(room_id="R1", user_id="U2"))) == "U2"
+
+
+def test_rate_limit_key_without_user_id_is_per_chat():
+    assert rate_limit_key(MessageEvent(source=SourceGroup(group_id="G1"))) == "group:G1"
+    assert rate_limit_key(MessageEvent(source=SourceGroup(group_id="G2"))) == "group:G2"
+    assert rate_limit_key(MessageEvent(source=SourceRoom(room_id="R1"))) == "room:R1"
+    assert rate_limit_key(MessageEvent(source=SourceGroup())) == "group:unknown"
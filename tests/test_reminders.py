@@ -0,0 +1,126 @@
+# Drives ReminderFanout through the real LINE SDK client against a local HTTP stub
+# of the Messaging API multicast endpoint (the same LINE_API_ENDPOINT override app.py uses).
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+from linebot import LineBotApi
+
+from ratelimit import TokenBucket
+from reminders import ReminderFanout, plan_batches, DELIVERY_SENT, MULTICAST_LIMIT, ON_DUTY_STATUS
+
+DATE = "2025-11-01"
+
+
+class LineStub:
+    # Records every multicast; `script` holds (status, headers) answers per retry key,
+    # used up in order, with 200 once a key's list is empty.
+
+    def __init__(self):
+        self.requests = []
+        self.script = {}
+        self._lock = threading.Lock()
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+                key = self.headers.get("X-Line-Retry-Key")
+                with stub._lock:
+                    stub.requests.append({"path": self.path, "to": body["to"], "retry_key": key})
+                    answers = stub.script.get(key) or []
+                    status, headers = answers.pop(0) if answers else (200, {})
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                for name, value in headers.items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(b"{}" if status == 200 else b'{"message": "stub"}')
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.endpoint = f"http://127.0.0.1:{self.server.server_port}"
+
+
+@pytest.fixture
+def stub():
+    server = LineStub()
+    yield server
+    server.server.shutdown()
+    server.server.server_close()
+
+
+def _fanout(stub, sleeps):
+    api = LineBotApi("test-token", endpoint=stub.endpoint)
+    return ReminderFanout(api, TokenBucket(1000), max_workers=3, sleep=sleeps.append)
+
+
+def _assignments(count, duty="เวรยาม"):
+    assignments = [{"duty": duty, "name": f"p{i}", "status": ON_DUTY_STATUS} for i in range(count)]
+    return assignments, {f"p{i}": f"U{i:04d}" for i in range(count)}
+
+
+def test_batches_split_at_multicast_limit(stub):
+    assignments, line_ids = _assignments(1200)
+    assignments.append({"duty": "ลา (ลาป่วย)", "name": "p0", "status": "ลา"})
+    batches = plan_batches(DATE, assignments, line_ids)
+    assert [len(b["to"]) for b in batches] == [MULTICAST_LIMIT, MULTICAST_LIMIT, 200]
+
+    sleeps = []
+    results = _fanout(stub, sleeps).send(batches)
+    assert all(r["status"] == DELIVERY_SENT and r["attempts"] == 1 for r in results)
+    assert sorted(len(r["to"]) for r in stub.requests) == [200, MULTICAST_LIMIT, MULTICAST_LIMIT]
+    assert all(r["path"] == "/v2/bot/message/multicast" for r in stub.requests)
+    sent = [to for r in stub.requests for to in r["to"]]
+    assert len(sent) == len(set(sent)) == 1200
+    assert sleeps == []
+
+
+def test_429_waits_for_retry_after(stub):
+    assignments, line_ids = _assignments(3)
+    batch = plan_batches(DATE, assignments, line_ids)[0]
+    stub.script[batch["retry_key"]] = [(429, {"Retry-After": "7"})]
+
+    sleeps = []
+    result = _fanout(stub, sleeps).send([batch])[0]
+    assert result["status"] == DELIVERY_SENT
+    assert result["attempts"] == 2
+    assert sleeps == [7.0]
+    assert [r["retry_key"] for r in stub.requests] == [batch["retry_key"]] * 2
+
+
+def test_409_counts_as_sent(stub):
+    assignments, line_ids = _assignments(3)
+    batch = plan_batches(DATE, assignments, line_ids)[0]
+    stub.script[batch["retry_key"]] = [(409, {})]
+
+    sleeps = []
+    result = _fanout(stub, sleeps).send([batch])[0]
+    assert result["status"] == DELIVERY_SENT
+    assert result["attempts"] == 1
+    assert len(stub.requests) == 1
+    assert sleeps == []
+
+
+def test_retry_key_stable_across_reruns(stub):
+    assignments, line_ids = _assignments(700)
+    assignments += [{"duty": "เวรเสาร์", "name": "p1", "status": ON_DUTY_STATUS}]
+    first = plan_batches(DATE, assignments, line_ids)
+    second = plan_batches(DATE, list(assignments), dict(line_ids))
+    assert [(b["batch_id"], b["retry_key"]) for b in first] == [(b["batch_id"], b["retry_key"]) for b in second]
+    assert len({b["retry_key"] for b in first}) == len(first)
+    assert plan_batches("2025-11-02", assignments, line_ids)[0]["retry_key"] != first[0]["retry_key"]
+
+    sleeps = []
+    _fanout(stub, sleeps).send(first)
+    # a rerun of the same day: LINE answers 409 for keys it has already accepted
+    for batch in second:
+        stub.script[batch["retry_key"]] = [(409, {})]
+    results = _fanout(stub, sleeps).send(second)
+    assert all(r["status"] == DELIVERY_SENT for r in results)
+    keys = [r["retry_key"] for r in stub.requests]
+    assert sorted(keys[:len(first)]) == sorted(keys[len(first):]) == sorted(b["retry_key"] for b in first)
@@ -0,0 +1,182 @@
+# CircuitBreaker state machine on a hand-driven clock, and WriteAheadLog durability:
+# replay against concurrent appends and recovery from a torn final line
+import json
+import threading
+
+import pytest
+
+from resilience import CLOSED, HALF_OPEN, OPEN, CircuitBreaker, CircuitOpenError, WriteAheadLog
+
+
+class Clock:
+    def __init__(self):
+        self.now = 100.0
+
+    def __call__(self):
+        return self.now
+
+
+def _fail():
+    raise TimeoutError("deadline")
+
+
+@pytest.fixture
+def clock():
+    return Clock()
+
+
+@pytest.fixture
+def breaker(clock):
+    changes = []
+    breaker = CircuitBreaker(failure_threshold=2, reset_timeout=10, clock=clock)
+    breaker.add_listener(lambda old, new: changes.append((old, new)))
+    breaker.changes = changes
+    return breaker
+
+
+def _trip(breaker):
+    for _ in range(breaker.failure_threshold):
+        with pytest.raises(TimeoutError):
+            breaker.call(_fail)
+
+
+def test_opens_after_consecutive_failures(breaker):
+    with pytest.raises(TimeoutError):
+        breaker.call(_fail)
+    assert breaker.call(lambda: "ok") == "ok"
+    # the success reset the count, so one more failure keeps it closed
+    with pytest.raises(TimeoutError):
+        breaker.call(_fail)
+    assert breaker.state == CLOSED
+    with pytest.raises(TimeoutError):
+        breaker.call(_fail)
+    assert breaker.state == OPEN
+    assert breaker.changes == [(CLOSED, OPEN)]
+
+
+def test_open_refuses_without_calling(breaker, clock):
+    _trip(breaker)
+    calls = []
+    clock.now += 9.9
+    with pytest.raises(CircuitOpenError):
+        breaker.call(lambda: calls.append(1))
+    assert calls == []
+
+
+def test_half_open_success_closes(breaker, clock):
+    _trip(breaker)
+    clock.now += 10
+    assert breaker.state == HALF_OPEN
+    assert breaker.call(lambda: "ok") == "ok"
+    assert breaker.state == CLOSED
+    assert breaker.changes == [(CLOSED, OPEN), (OPEN, HALF_OPEN), (HALF_OPEN, CLOSED)]
+    # closed again: it takes the full threshold to re-open
+    with pytest.raises(TimeoutError):
+        breaker.call(_fail)
+    assert breaker.state == CLOSED
+
+
+def test_half_open_failure_reopens_for_a_full_timeout(breaker, clock):
+    _trip(breaker)
+    clock.now += 10
+    with pytest.raises(TimeoutError):
+        breaker.call(_fail)
+    assert breaker.state == OPEN
+    assert breaker.changes == [(CLOSED, OPEN), (OPEN, HALF_OPEN), (HALF_OPEN, OPEN)]
+    clock.now += 9
+    with pytest.raises(CircuitOpenError):
+        breaker.call(lambda: "ok")
+    clock.now += 1
+    assert breaker.call(lambda: "ok") == "ok"
+    assert breaker.state == CLOSED
+
+
+def test_half_open_lets_one_trial_through(breaker, clock):
+    _trip(breaker)
+    clock.now += 10
+    assert breaker.allow()
+    assert not breaker.allow()
+    breaker.record_success()
+    assert breaker.allow()
+
+
+def test_ok_errors_count_as_success(breaker):
+    with pytest.raises(TimeoutError):
+        breaker.call(_fail)
+    for _ in range(3):
+        with pytest.raises(KeyError):
+            breaker.call(lambda: {}["missing"], ok_errors=(KeyError,))
+    with pytest.raises(TimeoutError):
+        breaker.call(_fail)
+    assert breaker.state == CLOSED
+
+
+def test_wal_survives_reopen(tmp_path):
+    path = str(tmp_path / "wal" / "leaves.jsonl")
+    wal = WriteAheadLog(path)
+    wal.append({"op": "set", "id": "a"})
+    wal.append({"op": "delete", "id": "a"})
+    reopened = WriteAheadLog(path)
+    assert len(reopened) == 2
+    assert [e["op"] for e in reopened.entries()] == ["set", "delete"]
+
+
+def test_replay_stops_at_first_failure(tmp_path):
+    wal = WriteAheadLog(str(tmp_path / "leaves.jsonl"))
+    for i in range(4):
+        wal.append({"id": i})
+
+    def apply(entry):
+        if entry["id"] == 2:
+            raise TimeoutError("deadline")
+
+    assert wal.replay(apply) == (2, 2)
+    assert [e["id"] for e in wal.entries()] == [2, 3]
+    assert len(wal) == 2
+
+
+def test_replay_keeps_entries_appended_meanwhile(tmp_path):
+    wal = WriteAheadLog(str(tmp_path / "leaves.jsonl"))
+    for i in range(3):
+        wal.append({"id": i})
+    applied = []
+    started = threading.Event()
+    release = threading.Event()
+
+    def apply(entry):
+        applied.append(entry["id"])
+        if entry["id"] == 0:
+            started.set()
+            release.wait(5)
+
+    replay = threading.Thread(target=lambda: wal.replay(apply))
+    replay.start()
+    assert started.wait(5)
+    # a second replay while one is running is refused
+    assert wal.replay(apply) is None
+    wal.append({"id": 3})
+    wal.append({"id": 4})
+    release.set()
+    replay.join(5)
+    assert applied == [0, 1, 2]
+    assert [e["id"] for e in wal.entries()] == [3, 4]
+    assert len(wal) == 2
+
+
+def test_torn_final_line_is_skipped(tmp_path):
+    path = tmp_path / "leaves.jsonl"
+    path.write_text(json.dumps({"id": 1}) + "\n" + '{"id": 2, "da', encoding="utf-8")
+    wal = WriteAheadLog(str(path))
+    assert len(wal) == 1
+    # the next append starts on a line of its own instead of being glued to the tear
+    wal.append({"id": 3})
+    assert [e["id"] for e in WriteAheadLog(str(path)).entries()] == [1, 3]
+
+
+def test_complete_final_line_without_newline_is_kept(tmp_path):
+    path = tmp_path / "leaves.jsonl"
+    path.write_text(json.dumps({"id": 1}) + "\n" + json.dumps({"id": 2}), encoding="utf-8")
+    wal = WriteAheadLog(str(path))
+    wal.append({"id": 3})
+    assert [e["id"] for e in wal.entries()] == [1, 2, 3]
+    assert len(wal) == 3
@@ -0,0 +1,108 @@
+# Property checks for the balanced rotation over random personnel, duties and leaves
+import random
+from datetime import date, timedelta
+
+import pytest
+
+from models import Personnel, Duty, Leave
+from roster import RotationTable, STATUS_ON_DUTY
+
+START = date(2025, 1, 1)
+DAYS = 60
+# longer than the 90-day balance window, so repairs start with a partly filled window
+REPAIR_DAYS = 240
+TRIALS = 200
+
+
+def _random_inputs(rng):
+    people = [Personnel.from_dict({"name": f"p{i}", "duty_priority": rng.randrange(5)})
+              for i in range(rng.randint(1, 12))]
+    duties = [Duty.from_dict({"duty_name": f"d{j}", "priority": j}) for j in range(rng.randint(1, 4))]
+    leaves = [_random_leave(rng, people) for _ in range(rng.randint(0, 10))]
+    return people, duties, leaves
+
+
+def _random_leave(rng, people, days=DAYS):
+    first = START + timedelta(days=rng.randrange(-10, days + 10))
+    return Leave.from_dict({"personnel_name": rng.choice(people).name, "leave_type": "ลาพัก",
+                            "start_date": first.isoformat(),
+                            "end_date": (first + timedelta(days=rng.randrange(6))).isoformat()})
+
+
+def _days(days=DAYS):
+    return [START + timedelta(days=offset) for offset in range(days)]
+
+
+def _on_leave(leaves, day):
+    ordinal = day.toordinal()
+    return {leave.personnel_name for leave in leaves if leave.covers(ordinal)}
+
+
+@pytest.mark.parametrize("seed", range(TRIALS))
+def test_nobody_on_leave_is_assigned(seed):
+    people, duties, leaves = _random_inputs(random.Random(seed))
+    table = RotationTable(people, duties, leaves, START, DAYS)
+    for day in _days():
+        off = _on_leave(leaves, day)
+        on_duty = [row["name"] for row in table.assignments_for(day) if row["status"] == STATUS_ON_DUTY]
+        assert not off & set(on_duty), day
+
+
+@pytest.mark.parametrize("seed", range(TRIALS))
+def test_one_duty_per_person_per_day(seed):
+    # only promised while enough people are available to fill every duty
+    people, duties, leaves = _random_inputs(random.Random(seed))
+    table = RotationTable(people, duties, leaves, START, DAYS)
+    for day in _days():
+        available = len(people) - len(_on_leave(leaves, day))
+        if available < len(duties):
+            continue
+        on_duty = [row["name"] for row in table.assignments_for(day) if row["status"] == STATUS_ON_DUTY]
+        assert len(on_duty) == len(duties)
+        assert len(set(on_duty)) == len(on_duty), day
+
+
+@pytest.mark.parametrize("seed", range(TRIALS))
+def test_incremental_repair_matches_full_rebuild(seed):
+    rng = random.Random(seed)
+    people, duties, _ = _random_inputs(rng)
+    leaves = [_random_leave(rng, people, REPAIR_DAYS) for _ in range(rng.randint(0, 30))]
+    before = RotationTable(people, duties, leaves, START, REPAIR_DAYS)
+    changed = list(leaves)
+    if changed and rng.random() < 0.5:
+        changed.pop(rng.randrange(len(changed)))
+    changed += [_random_leave(rng, people, REPAIR_DAYS) for _ in range(rng.randint(0, 3))]
+    repaired = RotationTable(people, duties, changed, START, REPAIR_DAYS, previous=before)
+    rebuilt = RotationTable(people, duties, changed, START, REPAIR_DAYS)
+    assert repaired._subs == rebuilt._subs
+    for day in _days(REPAIR_DAYS) + [START - timedelta(days=5), START + timedelta(days=REPAIR_DAYS + 5)]:
+        assert repaired.assignments_for(day) == rebuilt.assignments_for(day)
+
+
+@pytest.mark.parametrize("seed", range(TRIALS))
+def test_lookups_agree_with_assignments(seed):
+    rng = random.Random(seed)
+    people, duties, leaves = _random_inputs(rng)
+    table = RotationTable(people, duties, leaves, START, DAYS)
+    outside = [START - timedelta(days=3), START + timedelta(days=DAYS + 3)]
+    for day in _days() + outside:
+        on_duty = [row["name"] for row in table.assignments_for(day) if row["status"] == STATUS_ON_DUTY]
+        for i in range(len(duties)):
+            expected = on_duty[i] if on_duty else None
+            assert table.who_is_on(i, day) == expected, (day, i)
+            idx = table.person_index_on(i, day)
+            assert (None if idx is None else table.names[idx]) == expected
+
+    # next_duty: the first slot on or after from_day inside the horizon, as a linear scan finds it
+    for person in people:
+        from_day = START + timedelta(days=rng.randrange(DAYS))
+        expected = None
+        for day in _days():
+            if day < from_day:
+                continue
+            rows = [row for row in table.assignments_for(day) if row["status"] == STATUS_ON_DUTY]
+            hit = next((row["duty"] for row in rows if row["name"] == person.name), None)
+            if hit is not None:
+                expected = (day, hit)
+                break
+        assert table.next_duty(person.name, from_day) == expected, person.name
@@ -0,0 +1,163 @@
+# What-if rosters: RosterOverlay must never touch the live inputs, and the diff
+# must follow each duty by id, even when several duties share a name
+import random
+from datetime import date, timedelta
+
+import pytest
+
+from models import Personnel, Duty, Leave
+from roster import RotationTable, inputs_version, STATUS_ON_DUTY
+from simulation import RosterOverlay, diff_assignments
+
+START = date(2025, 1, 1)
+DAYS = 30
+TRIALS = 200
+
+
+def _random_inputs(rng):
+    people = [Personnel.from_dict({"name": f"p{i}", "duty_priority": rng.randrange(5)}, f"P{i}")
+              for i in range(rng.randint(2, 10))]
+    # few distinct names, so duties often share one
+    duties = [Duty.from_dict({"duty_name": f"d{rng.randrange(2)}", "priority": j}, f"D{j}")
+              for j in range(rng.randint(1, 4))]
+    leaves = [_random_leave(rng, people, f"L{k}") for k in range(rng.randint(0, 6))]
+    return people, duties, leaves
+
+
+def _random_leave(rng, people, doc_id=None):
+    first = START + timedelta(days=rng.randrange(DAYS))
+    data = {"personnel_name": rng.choice(people).name, "leave_type": "ลาพัก",
+            "start_date": first.isoformat(),
+            "end_date": (first + timedelta(days=rng.randrange(4))).isoformat()}
+    return Leave.from_dict(data, doc_id) if doc_id else data
+
+
+def _random_edits(rng, overlay, people, duties, leaves):
+    for _ in range(rng.randint(1, 6)):
+        op = rng.randrange(6)
+        if op == 0:
+            overlay.add_leave({**_random_leave(rng, people), "doc_id": f"new{rng.randrange(99)}"})
+        elif op == 1 and leaves:
+            overlay.remove_leave(rng.choice(leaves).doc_id)
+        elif op == 2:
+            overlay.add_personnel({"name": f"q{rng.randrange(99)}", "duty_priority": rng.randrange(5)})
+        elif op == 3:
+            overlay.remove_personnel(rng.choice(people).name)
+        elif op == 4:
+            overlay.add_duty({"duty_name": f"d{rng.randrange(3)}", "priority": rng.randrange(5)})
+        else:
+            overlay.remove_duty(rng.choice(duties).duty_name)
+
+
+def _snapshot(records):
+    return [(r.doc_id, r.to_dict()) for r in records]
+
+
+@pytest.mark.parametrize("seed", range(TRIALS))
+def test_overlay_never_mutates_base(seed):
+    rng = random.Random(seed)
+    base = _random_inputs(rng)
+    before = [_snapshot(records) for records in base]
+    version = inputs_version(*base)
+
+    overlay = RosterOverlay(*base)
+    _random_edits(rng, overlay, *base)
+    inputs = overlay.inputs()
+
+    assert [_snapshot(records) for records in base] == before
+    assert inputs_version(*base) == version
+    # lists no edit touched are the base lists themselves, edited ones are copies
+    for name, current, original in zip(("personnel", "duties", "leaves"), inputs, base):
+        assert (current is not original) == (name in overlay.changed)
+
+
+def test_overlay_shares_untouched_lists():
+    people, duties, leaves = _random_inputs(random.Random(0))
+    overlay = RosterOverlay(people, duties, leaves)
+    overlay.remove_leave("no-such-leave")
+    overlay.remove_personnel("nobody")
+    assert overlay.changed == []
+    overlay.add_leave({"personnel_name": people[0].name, "leave_type": "ลาป่วย",
+                       "start_date": "2025-01-02", "end_date": "2025-01-03"})
+    assert overlay.changed == ["leaves"]
+    current = overlay.inputs()
+    assert current[0] is people and current[1] is duties
+    assert len(current[2]) == len(leaves) + 1
+
+
+class FakeTable:
+    # just what diff_assignments reads: the duty records and each day's rows
+    def __init__(self, duties, rows):
+        self.source = ([], duties, [])
+        self._rows = rows
+
+    def assignments_for(self, day):
+        return self._rows
+
+
+def _duty(name, doc_id=None):
+    return Duty.from_dict({"duty_name": name}, doc_id)
+
+
+def _on_duty(*pairs):
+    return [{"duty": duty, "name": name, "status": STATUS_ON_DUTY} for duty, name in pairs]
+
+
+def test_same_named_duties_follow_their_ids():
+    before = FakeTable([_duty("เวรยาม", "a"), _duty("เวรยาม", "b")], _on_duty(("เวรยาม", "p1"), ("เวรยาม", "p2")))
+    # the duties come back in the other order with the same people: nothing changed
+    after = FakeTable([_duty("เวรยาม", "b"), _duty("เวรยาม", "a")], _on_duty(("เวรยาม", "p2"), ("เวรยาม", "p1")))
+    assert diff_assignments(before, after, START, START) == []
+
+    # only duty b changes hands
+    after = FakeTable([_duty("เวรยาม", "b"), _duty("เวรยาม", "a")], _on_duty(("เวรยาม", "p3"), ("เวรยาม", "p1")))
+    assert diff_assignments(before, after, START, START) == [
+        {"date": START.isoformat(), "duty": "เวรยาม", "before": "p2", "after": "p3"}]
+
+
+def test_same_named_duties_without_ids_keep_their_occurrence():
+    before = FakeTable([_duty("เวรยาม"), _duty("เวรยาม")], _on_duty(("เวรยาม", "p1"), ("เวรยาม", "p2")))
+    after = FakeTable([_duty("เวรยาม"), _duty("เวรยาม")], _on_duty(("เวรยาม", "p1"), ("เวรยาม", "p3")))
+    changes = diff_assignments(before, after, START, START)
+    assert [(c["before"], c["after"]) for c in changes] == [("p2", "p3")]
+
+
+def test_removed_duty_reports_its_slot_only():
+    before = FakeTable([_duty("เวรยาม", "a"), _duty("เวรยาม", "b")], _on_duty(("เวรยาม", "p1"), ("เวรยาม", "p2")))
+    after = FakeTable([_duty("เวรยาม", "b")], _on_duty(("เวรยาม", "p2")))
+    assert diff_assignments(before, after, START, START) == [
+        {"date": START.isoformat(), "duty": "เวรยาม", "before": "p1", "after": None}]
+
+
+def _slots(table, day):
+    # brute force: on-duty rows by duty position (duty ids are unchanged), leave rows by person
+    rows = table.assignments_for(day)
+    duty_ids = [d.doc_id for d in table.source[1]]
+    on_duty = [row for row in rows if row["status"] == STATUS_ON_DUTY]
+    slots = {("duty", duty_id): row["name"] for duty_id, row in zip(duty_ids, on_duty)}
+    slots.update({("leave", row["duty"], row["name"]): row["name"] for row in rows if row["status"] != STATUS_ON_DUTY})
+    return slots
+
+
+@pytest.mark.parametrize("seed", range(TRIALS))
+def test_leave_simulation_diff_matches_slot_comparison(seed):
+    rng = random.Random(seed)
+    people, duties, leaves = _random_inputs(rng)
+    live = RotationTable(people, duties, leaves, START, DAYS)
+    overlay = RosterOverlay(people, duties, leaves)
+    for _ in range(rng.randint(1, 3)):
+        overlay.add_leave(_random_leave(rng, people))
+    if leaves and rng.random() < 0.5:
+        overlay.remove_leave(rng.choice(leaves).doc_id)
+    simulated = RotationTable(*overlay.inputs(), START, DAYS, previous=live)
+
+    last = START + timedelta(days=DAYS - 1)
+    changes = diff_assignments(live, simulated, START, last)
+    expected = 0
+    day = START
+    while day <= last:
+        old, new = _slots(live, day), _slots(simulated, day)
+        expected += sum(1 for key in old.keys() | new.keys() if old.get(key) != new.get(key))
+        day += timedelta(days=1)
+    assert len(changes) == expected
+    assert diff_assignments(live, live, START, last) == []
@@ -0,0 +1,102 @@
+# StaffingValidator's event sweep checked day by day against a brute-force count over
+# random personnel (with duplicate names), leaves and query ranges
+import random
+from datetime import date
+
+import pytest
+
+from staffing import StaffingValidator
+
+START = date(2025, 1, 1).toordinal()
+DAYS = 60
+TRIALS = 200
+
+
+def _random_case(rng):
+    names = [f"p{rng.randrange(8)}" for _ in range(rng.randint(1, 10))]
+    required = rng.randint(1, len(names) + 1)
+    # leaves may overlap, repeat a person, name someone not on the roster, or be empty
+    pool = sorted(set(names)) + ["stranger"]
+    leaves = []
+    for _ in range(rng.randint(0, 15)):
+        first = START + rng.randrange(-10, DAYS + 10)
+        leaves.append((first, first + rng.randrange(-1, 8), rng.choice(pool)))
+    return names, required, leaves
+
+
+def _random_range(rng):
+    first = START + rng.randrange(-15, DAYS + 15)
+    return first, first + rng.randrange(DAYS)
+
+
+def _day_state(names, leaves, ordinal):
+    on_leave = {name for s, e, name in leaves if s <= ordinal <= e and name in names}
+    available = sum(1 for name in names if name not in on_leave)
+    return available, on_leave
+
+
+def _by_day(segments):
+    # expand shortfall runs to {ordinal: (available, on_leave)}, checking they are
+    # ordered and disjoint
+    days = {}
+    previous = None
+    for item in segments:
+        first = date.fromisoformat(item["start"]).toordinal()
+        last = date.fromisoformat(item["end"]).toordinal()
+        assert first <= last
+        assert previous is None or first > previous
+        previous = last
+        for ordinal in range(first, last + 1):
+            days[ordinal] = (item["available"], set(item["on_leave"]))
+    return days
+
+
+@pytest.mark.parametrize("seed", range(TRIALS))
+def test_shortfalls_match_brute_force(seed):
+    rng = random.Random(seed)
+    names, required, leaves = _random_case(rng)
+    validator = StaffingValidator(names, required, leaves)
+    for _ in range(5):
+        first, last = _random_range(rng)
+        result = validator.shortfalls(first, last)
+        assert all(item["required"] == required for item in result)
+        expected = {}
+        for ordinal in range(first, last + 1):
+            available, on_leave = _day_state(names, leaves, ordinal)
+            if available < required:
+                expected[ordinal] = (available, on_leave)
+        assert _by_day(result) == expected
+
+
+@pytest.mark.parametrize("seed", range(TRIALS))
+def test_conflicts_match_brute_force(seed):
+    rng = random.Random(seed)
+    names, required, leaves = _random_case(rng)
+    validator = StaffingValidator(names, required, leaves)
+    for _ in range(5):
+        first, last = _random_range(rng)
+        last = first + rng.randrange(10)
+        name = rng.choice(names + ["stranger"])
+        result = validator.conflicts(first, last, name)
+        expected = {}
+        if name in names:
+            for ordinal in range(first, last + 1):
+                _, already_off = _day_state(names, leaves, ordinal)
+                if name in already_off:
+                    continue
+                available, on_leave = _day_state(names, leaves + [(first, last, name)], ordinal)
+                if available < required:
+                    expected[ordinal] = (available, on_leave)
+        assert _by_day(result) == expected
+
+
+@pytest.mark.parametrize("seed", range(TRIALS))
+def test_add_matches_constructor(seed):
+    rng = random.Random(seed)
+    names, required, leaves = _random_case(rng)
+    built = StaffingValidator(names, required, leaves)
+    added = StaffingValidator(names, required)
+    for leave in leaves:
+        added.add(*leave)
+    first, last = _random_range(rng)
+    assert added.shortfalls(first, last) == built.shortfalls(first, last)
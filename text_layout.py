@@ -0,0 +1,141 @@
+# text_layout.py - line wrapping for Thai/Latin text on the generated images
+#
+# Thai is written without spaces between words, so a line may only break at a
+# space, at a word boundary (when pythainlp is installed), or between character
+# clusters. A cluster is a base character plus its combining vowels/tone marks,
+# and a leading vowel (เ แ โ ใ ไ) stays with the consonant after it; following
+# vowels such as ะ า ำ and the repetition mark ๆ never start a line.
+#
+# Widths come from a per-font cache of cluster advances instead of measuring every
+# candidate line with textlength(); clusters repeat constantly in Thai text, so a
+# long reason is measured with a handful of font calls.
+import threading
+
+try:
+    from pythainlp.tokenize import word_tokenize
+except ImportError:
+    word_tokenize = None
+
+# above/below vowels, tone marks and other combining signs
+_COMBINING = frozenset("ัิีึืฺุู็่้๊๋์ํ๎")
+# written before the consonant they follow in speech
+_LEADING = frozenset("เแโใไ")
+# may not begin a line
+_NO_BREAK_BEFORE = frozenset("ะาำๅๆ") | _COMBINING
+_THAI_START, _THAI_END = "฀", "๿"
+
+
+def clusters(text):
+    # Split into units that are never broken apart when wrapping
+    out = []
+    attach_next = False
+    for ch in text:
+        if out and (attach_next or ch in _NO_BREAK_BEFORE):
+            out[-1] += ch
+        else:
+            out.append(ch)
+        attach_next = ch in _LEADING
+    return out
+
+
+def _is_thai(ch):
+    return _THAI_START <= ch <= _THAI_END
+
+
+def break_units(text):
+    # Pieces of `text` between allowed line breaks; a trailing space belongs to the
+    # piece before it. Without a Thai word segmenter, Thai runs break per cluster.
+    units = []
+    for word in (word_tokenize(text, keep_whitespace=True) if word_tokenize else _split_spaces(text)):
+        if units and (word.isspace() or word[0] in _NO_BREAK_BEFORE):
+            units[-1] += word
+        elif word_tokenize is None and any(_is_thai(ch) for ch in word):
+            units.extend(_split_thai_runs(word))
+        else:
+            units.append(word)
+    return units
+
+
+def _split_spaces(text):
+    words = []
+    current = ""
+    for ch in text:
+        if ch.isspace() != current[-1:].isspace() and current:
+            words.append(current)
+            current = ""
+        current += ch
+    if current:
+        words.append(current)
+    return words
+
+
+def _split_thai_runs(word):
+    # Latin runs inside a Thai word (numbers, names) stay whole; Thai runs split per cluster
+    units = []
+    for cluster in clusters(word):
+        if units and not _is_thai(cluster[0]) and not _is_thai(units[-1][-1]):
+            units[-1] += cluster
+        else:
+            units.append(cluster)
+    return units
+
+
+class TextMeasurer:
+    # Width of text in one font, summed from cached cluster advances
+
+    def __init__(self, font):
+        self.font = font
+        self._advances = {}
+        self._lock = threading.Lock()
+
+    def _advance(self, cluster):
+        width = self._advances.get(cluster)
+        if width is None:
+            width = self.font.getlength(cluster)
+            with self._lock:
+                self._advances[cluster] = width
+        return width
+
+    def width(self, text):
+        return sum(self._advance(c) for c in clusters(text))
+
+    def wrap(self, text, max_width):
+        # Lines of `text` no wider than max_width (a single cluster wider than that
+        # still gets a line of its own); explicit newlines are kept.
+        lines = []
+        for paragraph in str(text).split("\n"):
+            line, line_width = "", 0.0
+            for unit in break_units(paragraph):
+                unit_width = self.width(unit)
+                if line and line_width + self.width(unit.rstrip()) > max_width:
+                    lines.append(line.rstrip())
+                    line, line_width = "", 0.0
+                    unit = unit.lstrip()
+                    unit_width = self.width(unit)
+                if unit_width > max_width:
+                    # one unbroken word longer than the line: fall back to clusters
+                    for cluster in clusters(unit):
+                        cluster_width = self._advance(cluster)
+                        if line and line_width + cluster_width > max_width:
+                            lines.append(line.rstrip())
+                            line, line_width = "", 0.0
+                        line += cluster
+                        line_width += cluster_width
+                    continue
+                line += unit
+                line_width += unit_width
+            lines.append(line.rstrip())
+        return lines
+
+    def fit(self, text, max_width, ellipsis="…"):
+        # text cut at a cluster boundary so that it (plus ellipsis) fits max_width
+        if self.width(text) <= max_width:
+            return text
+        budget = max_width - self.width(ellipsis)
+        out, used = "", 0.0
+        for cluster in clusters(text):
+            used += self._advance(cluster)
+            if used > budget:
+                break
+            out += cluster
+        return out + ellipsis